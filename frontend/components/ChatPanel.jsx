@@ -6,6 +6,7 @@ export default function ChatPanel({ repo }) {
   const [messages, setMessages] = useState([]);
   const [goal, setGoal] = useState("");
   const [plan, setPlan] = useState(null);
+  const [lastGoal, setLastGoal] = useState("");
   const [loadingPlan, setLoadingPlan] = useState(false);
   const [executing, setExecuting] = useState(false);
   const [status, setStatus] = useState("");
@@ -16,9 +17,9 @@ export default function ChatPanel({ repo }) {
     messagesEndRef.current?.scrollIntoView({ behavior: "smooth" });
   }, [messages]);
 
-  const send = async () => {
-    if (!goal.trim()) return;
-    const userMsg = { from: "user", text: goal.trim() };
+  // refresh asks the server to plan again instead of reusing a cached plan
+  const requestPlan = async (text, refresh = false) => {
+    const userMsg = { from: "user", text };
     setMessages((msgs) => [...msgs, userMsg]);
     setLoadingPlan(true);
     setStatus("");
@@ -34,13 +35,15 @@ export default function ChatPanel({ repo }) {
         body: JSON.stringify({
           repo_owner: repo.owner,
           repo_name: repo.name,
-          goal: goal.trim(),
+          goal: text,
+          refresh,
         }),
       });
       const data = await res.json();
       if (!res.ok) throw new Error(data.detail || "Failed to generate plan");
 
       setPlan(data);
+      setLastGoal(text);
       setMessages((msgs) => [
         ...msgs,
         {
@@ -58,6 +61,16 @@ export default function ChatPanel({ repo }) {
     }
   };
 
+  const send = () => {
+    if (!goal.trim()) return;
+    requestPlan(goal.trim());
+  };
+
+  const replan = () => {
+    if (!lastGoal) return;
+    requestPlan(lastGoal, true);
+  };
+
   const execute = async () => {
     if (!plan) return;
     setExecuting(true);
@@ -148,6 +161,15 @@ export default function ChatPanel({ repo }) {
           >
             {loadingPlan ? "Planning..." : "Generate plan"}
           </button>
+          <button
+            className="chat-btn secondary"
+            type="button"
+            onClick={replan}
+            disabled={!lastGoal || loadingPlan}
+            title="Plan the last request again instead of reusing a cached plan"
+          >
+            Re-plan
+          </button>
           <button
             className="chat-btn secondary"
             type="button"
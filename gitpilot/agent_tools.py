@@ -5,20 +5,215 @@ Provides CrewAI-compatible tools for agents to explore and analyze repositories.
 from __future__ import annotations
 
 import asyncio
-from typing import Any, Dict, List, Optional
+import io
+import logging
+import re
+import sys
+import threading
+import time
+from collections import Counter, OrderedDict, defaultdict
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 from crewai.tools import tool
 
-from .github_api import get_repo_tree, get_file
+from .github_api import (
+    RepoTree,
+    get_file_blob,
+    get_files_batch,
+    get_repo_tree,
+    rate_limit_budget,
+)
+
+logger = logging.getLogger(__name__)
 
 # Global context for current repository
 # Now includes 'token' to ensure tools can authenticate even in threads
 _current_repo_context: Dict[str, Any] = {}
 
-def set_repo_context(owner: str, repo: str, token: Optional[str] = None):
-    """Set the current repository context for tools."""
+# Context entries derived from the repository tree; dropped whenever it changes
+_DERIVED_CONTEXT_KEYS = (
+    "tree",
+    "summary",
+    "sorted_paths",
+    "file_listing",
+    "structure_listing",
+    "trie",
+    "paths_lower",
+    "sha_index",
+    "files_summary",
+)
+
+# Files worth reading first when exploring a repository (matched on the lowercased path)
+_KEY_FILE_NAMES = (
+    "readme",
+    "license",
+    "makefile",
+    "dockerfile",
+    "requirements",
+    "package.json",
+    ".gitignore",
+)
+_KEY_FILE_RE = re.compile("|".join(map(re.escape, _KEY_FILE_NAMES)))
+
+try:
+    import ahocorasick
+
+    _KEY_FILE_AUTOMATON = ahocorasick.Automaton()
+    for _name in _KEY_FILE_NAMES:
+        _KEY_FILE_AUTOMATON.add_word(_name, _name)
+    _KEY_FILE_AUTOMATON.make_automaton()
+except ImportError:  # optional: fall back to the compiled regex
+    _KEY_FILE_AUTOMATON = None
+
+def _is_key_file(path_lower: str) -> bool:
+    """Return True when a lowercased path contains one of the key-file names."""
+    if _KEY_FILE_AUTOMATON is not None:
+        return next(_KEY_FILE_AUTOMATON.iter(path_lower), None) is not None
+    return _KEY_FILE_RE.search(path_lower) is not None
+
+# Repository trees keyed by (owner, repo) so every tool in an agent turn
+# shares a single GitHub Tree API call instead of refetching it.
+_TREE_CACHE_TTL = 60.0
+_TREE_CACHE: Dict[Tuple[str, str], Tuple[float, RepoTree]] = {}
+_TREE_CACHE_LOCK = threading.Lock()
+
+# File contents keyed by (owner, repo, blob sha); blobs are content-addressed
+# so an entry never goes stale, only unreachable. Bounded as an LRU.
+_BLOB_CACHE_SIZE = 512
+_BLOB_CACHE: OrderedDict[Tuple[str, str, str], str] = OrderedDict()
+_BLOB_CACHE_LOCK = threading.Lock()
+
+def _cached_blob(owner: str, repo: str, sha: Optional[str]) -> Optional[str]:
+    """Return cached blob text for a sha, marking it as recently used."""
+    if not sha:
+        return None
+    key = (owner, repo, sha)
+    with _BLOB_CACHE_LOCK:
+        text = _BLOB_CACHE.get(key)
+        if text is not None:
+            _BLOB_CACHE.move_to_end(key)
+        return text
+
+def _cache_blob(owner: str, repo: str, sha: str, text: str) -> None:
+    if not sha:
+        return
+    with _BLOB_CACHE_LOCK:
+        _BLOB_CACHE[(owner, repo, sha)] = text
+        _BLOB_CACHE.move_to_end((owner, repo, sha))
+        while len(_BLOB_CACHE) > _BLOB_CACHE_SIZE:
+            _BLOB_CACHE.popitem(last=False)
+
+# A tool call blocks a CrewAI worker thread, so a rate limit gets one short
+# retry before the tool reports it to the agent instead of the client's full
+# budget of minute-long waits.
+_TOOL_RATE_LIMIT_RETRIES = 1
+_TOOL_MAX_RATE_LIMIT_WAIT = 10.0
+
+# Long-lived event loop the sync tool wrappers dispatch coroutines onto, so
+# loop setup and HTTP connections are not rebuilt on every tool call. The
+# timeout leaves room for the tools' rate-limit wait.
+_TOOL_TIMEOUT = 30.0 + _TOOL_RATE_LIMIT_RETRIES * _TOOL_MAX_RATE_LIMIT_WAIT
+_tool_loop: Optional[asyncio.AbstractEventLoop] = None
+_tool_loop_lock = threading.Lock()
+
+# The API server's own loop, registered at startup. Tools run inside CrewAI
+# worker threads, so they can hand coroutines to it and share its connections.
+_app_loop: Optional[asyncio.AbstractEventLoop] = None
+
+def register_app_loop(loop: Optional[asyncio.AbstractEventLoop]) -> None:
+    """Let tools dispatch onto the server's event loop (None to unregister)."""
+    global _app_loop
+    _app_loop = loop
+
+def _get_tool_loop() -> asyncio.AbstractEventLoop:
+    """Return the shared background loop, starting it on first use."""
+    global _tool_loop
+    with _tool_loop_lock:
+        if _tool_loop is None:
+            try:
+                import uvloop
+
+                _tool_loop = uvloop.new_event_loop()
+            except ImportError:  # uvicorn[standard] skips uvloop on Windows / PyPy
+                _tool_loop = asyncio.new_event_loop()
+            threading.Thread(
+                target=_tool_loop.run_forever,
+                name="gitpilot-tools-loop",
+                daemon=True,
+            ).start()
+        return _tool_loop
+
+def _run_async(coro) -> Any:
+    """Run a coroutine on the server loop (or the shared tool loop) and wait for it."""
+    loop = _app_loop
+    if loop is None or not loop.is_running() or _in_loop_thread(loop):
+        # Blocking on the loop we are running in would deadlock
+        loop = _get_tool_loop()
+    future = asyncio.run_coroutine_threadsafe(_with_tool_budget(coro), loop)
+    try:
+        return future.result(timeout=_TOOL_TIMEOUT)
+    except TimeoutError:
+        # Stop the coroutine as well, or it keeps retrying on the loop
+        future.cancel()
+        raise
+
+async def _with_tool_budget(coro) -> Any:
+    # Set inside the task, which runs in a context of its own on the loop
+    with rate_limit_budget(_TOOL_RATE_LIMIT_RETRIES, _TOOL_MAX_RATE_LIMIT_WAIT):
+        return await coro
+
+def _in_loop_thread(loop: asyncio.AbstractEventLoop) -> bool:
+    try:
+        return asyncio.get_running_loop() is loop
+    except RuntimeError:
+        return False
+
+def set_repo_context(
+    owner: str,
+    repo: str,
+    token: Optional[str] = None,
+    staged: Optional[Dict[str, Optional[str]]] = None,
+):
+    """Set the current repository context for tools.
+
+    ``staged`` maps paths to changes not yet committed (new content, or None
+    for a deletion). The file tools read through it, so a plan's later steps
+    see what its earlier steps wrote. The mapping is read live, not copied.
+    """
     global _current_repo_context
     _current_repo_context = {"owner": owner, "repo": repo, "token": token}
+    if staged is not None:
+        _current_repo_context["staged"] = staged
+    # A new context starts from a fresh view of the repository
+    invalidate_repo_tree(owner, repo)
+
+def invalidate_repo_tree(owner: str, repo: str) -> None:
+    """Drop the cached tree for a repository (call after writing to it)."""
+    with _TREE_CACHE_LOCK:
+        _TREE_CACHE.pop((owner, repo), None)
+    if _current_repo_context.get("owner") == owner and _current_repo_context.get("repo") == repo:
+        for key in _DERIVED_CONTEXT_KEYS:
+            _current_repo_context.pop(key, None)
+
+def refresh_repo_context() -> None:
+    """Forget the tree and summary preloaded for the current repository."""
+    owner = _current_repo_context.get("owner", "")
+    repo = _current_repo_context.get("repo", "")
+    if owner and repo:
+        invalidate_repo_tree(owner, repo)
+
+async def _get_cached_tree(owner: str, repo: str, token: Optional[str] = None) -> RepoTree:
+    """Return the repository tree, reusing a recent fetch when available."""
+    key = (owner, repo)
+    with _TREE_CACHE_LOCK:
+        entry = _TREE_CACHE.get(key)
+    if entry and time.monotonic() - entry[0] < _TREE_CACHE_TTL:
+        return entry[1]
+
+    tree = await get_repo_tree(owner, repo, token=token)
+    with _TREE_CACHE_LOCK:
+        _TREE_CACHE[key] = (time.monotonic(), tree)
+    return tree
 
 def get_repo_context() -> tuple[str, str, Optional[str]]:
     """Get the current repository context including token."""
@@ -29,71 +224,177 @@ def get_repo_context() -> tuple[str, str, Optional[str]]:
         raise ValueError("Repository context not set. Call set_repo_context first.")
     return owner, repo, token
 
+def _staged_changes() -> Dict[str, Optional[str]]:
+    """Return a snapshot of the uncommitted changes of the current context."""
+    # Copied at once: a plan run may stage more files while a tool reads
+    return dict(_current_repo_context.get("staged") or {})
+
+def _is_current_repo(owner: str, repo: str) -> bool:
+    return _current_repo_context.get("owner") == owner and _current_repo_context.get("repo") == repo
+
+def _summarize_tree(tree: RepoTree) -> Dict[str, Any]:
+    """Derive file, extension, directory and key-file facts from a tree."""
+    return _summarize_paths(tree.paths, tree.sha)
+
+def _summarize_paths(all_files: List[str], tree_sha: str) -> Dict[str, Any]:
+    """Derive file, extension, directory and key-file facts from file paths."""
+    if not all_files:
+        return {
+            "all_files": [],
+            "total_files": 0,
+            "extensions": Counter(),
+            "directories": set(),
+            "key_files": [],
+            "tree_sha": tree_sha,
+        }
+
+    # Separate comprehension passes keep each loop inside C-implemented builtins
+    names = [path.rpartition("/")[2] for path in all_files]
+    extensions: Counter[str] = Counter(
+        "." + name.rpartition(".")[2] for name in names if "." in name
+    )
+    directories = {sys.intern(path.partition("/")[0]) for path in all_files if "/" in path}
+    key_files = [path for path in all_files if _is_key_file(path.lower())]
+
+    return {
+        "all_files": all_files,
+        "total_files": len(all_files),
+        "extensions": extensions,
+        "directories": directories,
+        "key_files": key_files,
+        "tree_sha": tree_sha,
+    }
+
 async def get_repository_context_summary(owner: str, repo: str, token: Optional[str] = None) -> Dict[str, Any]:
-    """Programmatically gather repository context."""
+    """Programmatically gather repository context.
+
+    When the repository is the current tool context, the tree and summary are
+    kept there so the tools can answer from memory instead of the network.
+    """
     try:
         # Pass token explicitly
-        tree = await get_repo_tree(owner, repo, token=token)
-
-        if not tree:
-            return {
-                "all_files": [],
-                "total_files": 0,
-                "extensions": {},
-                "directories": set(),
-                "key_files": [],
-            }
-
-        all_files = [item["path"] for item in tree]
-        extensions: Dict[str, int] = {}
-        directories: set = set()
-        key_files: List[str] = []
-
-        for item in tree:
-            path = item["path"]
-            if "." in path:
-                ext = "." + path.rsplit(".", 1)[1]
-                extensions[ext] = extensions.get(ext, 0) + 1
-            if "/" in path:
-                directories.add(path.split("/")[0])
-            
-            path_lower = path.lower()
-            if any(k in path_lower for k in ["readme", "package.json", "requirements.txt", "dockerfile", "makefile"]):
-                key_files.append(path)
+        tree = await _get_cached_tree(owner, repo, token=token)
+        summary = _summarize_tree(tree)
 
-        return {
-            "all_files": all_files,
-            "total_files": len(all_files),
-            "extensions": extensions,
-            "directories": directories,
-            "key_files": key_files,
-        }
+        if _is_current_repo(owner, repo):
+            _current_repo_context["tree"] = tree
+            _current_repo_context["summary"] = summary
+        return summary
 
     except Exception as e:
-        print(f"[Error] Failed to get repository context: {str(e)}")
+        logger.error("[GitPilot] Failed to get repository context: %s", e)
         return {"error": str(e), "total_files": 0}
 
+def _context_tree() -> RepoTree:
+    """Return the current repository tree, fetching it once per context."""
+    tree = _current_repo_context.get("tree")
+    if tree is None:
+        owner, repo, token = get_repo_context()
+        tree = _run_async(_get_cached_tree(owner, repo, token=token))
+        if _is_current_repo(owner, repo):
+            _current_repo_context["tree"] = tree
+    return tree
+
+def _context_summary() -> Dict[str, Any]:
+    """Return the summary of the current repository, computing it once per context."""
+    summary = _current_repo_context.get("summary")
+    if summary is None:
+        summary = _summarize_tree(_context_tree())
+        _current_repo_context["summary"] = summary
+    return summary
+
+def _context_derived(key: str, build: Callable[[], Any]) -> Any:
+    """Return a value derived from the file list, building it once per state.
+
+    The file list is the tree with the context's staged changes applied, so
+    the value is remembered together with the staged paths it was built from
+    and rebuilt when a plan stages or drops a file.
+    """
+    state = tuple(sorted((path, content is None) for path, content in _staged_changes().items()))
+    entry = _current_repo_context.get(key)
+    if entry is None or entry[0] != state:
+        entry = (state, build())
+        _current_repo_context[key] = entry
+    return entry[1]
+
+def _context_files_summary() -> Dict[str, Any]:
+    """Return the summary of the current repository as the tools should see it.
+
+    Files staged by the running plan are included and files it deleted are
+    left out; without staged changes this is the tree's own summary.
+    """
+    def build() -> Dict[str, Any]:
+        summary = _context_summary()
+        staged = _staged_changes()
+        if not staged:
+            return summary
+        committed = summary["all_files"]
+        paths = [path for path in committed if staged.get(path, "") is not None]
+        known = set(committed)
+        paths.extend(
+            path for path, content in staged.items()
+            if content is not None and path not in known
+        )
+        return _summarize_paths(paths, summary["tree_sha"])
+
+    return _context_derived("files_summary", build)
+
+def _context_sorted_paths() -> List[str]:
+    """Return the current repository paths in sorted order, sorting once per state."""
+    return _context_derived(
+        "sorted_paths", lambda: sorted(_context_files_summary()["all_files"])
+    )
+
+def _context_sha_index() -> Dict[str, str]:
+    """Return {path: blob sha} for the current repository."""
+    sha_index = _current_repo_context.get("sha_index")
+    if sha_index is None:
+        tree = _context_tree()
+        sha_index = dict(zip(tree.paths, tree.shas, strict=True))
+        _current_repo_context["sha_index"] = sha_index
+    return sha_index
+
+def _build_path_trie(paths: List[str]) -> Dict[str, Any]:
+    """Build a segment-level trie: directories map to child dicts, files to None."""
+    root: Dict[str, Any] = {}
+    for path in paths:
+        node = root
+        *dirs, name = path.split("/")
+        for segment in dirs:
+            node = node.setdefault(segment, {})
+        node[name] = None
+    return root
+
+def _context_trie() -> Dict[str, Any]:
+    """Return the path trie of the current repository, building it once per state."""
+    return _context_derived(
+        "trie", lambda: _build_path_trie(_context_files_summary()["all_files"])
+    )
+
+def _context_paths_lower() -> List[Tuple[str, str]]:
+    """Return (lowercased path, path) pairs for case-insensitive searches."""
+    return _context_derived(
+        "paths_lower",
+        lambda: [(path.lower(), path) for path in _context_files_summary()["all_files"]],
+    )
+
 @tool("List all files in repository")
 def list_repository_files() -> str:
     """Lists all files in the current repository."""
     try:
-        owner, repo, token = get_repo_context()
-        
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        try:
-            # Pass token explicitly
-            tree = loop.run_until_complete(get_repo_tree(owner, repo, token=token))
-        finally:
-            loop.close()
-
-        if not tree:
+        owner, repo, _ = get_repo_context()
+
+        paths = _context_sorted_paths()
+        if not paths:
             return "Repository is empty - no files found."
 
-        result = f"Repository: {owner}/{repo}\nFiles:\n"
-        for item in sorted(tree, key=lambda x: x["path"]):
-            result += f"  - {item['path']}\n"
-        return result
+        def render() -> str:
+            parts = [f"Repository: {owner}/{repo}\nFiles:\n"]
+            parts.extend(f"  - {p}\n" for p in paths)
+            return "".join(parts)
+
+        # The listing only changes with the file list, so render it once per state
+        return _context_derived("file_listing", render)
     except Exception as e:
         return f"Error listing files: {str(e)}"
 
@@ -101,55 +402,155 @@ def list_repository_files() -> str:
 def get_directory_structure() -> str:
     """Gets the hierarchical directory structure."""
     try:
-        owner, repo, token = get_repo_context()
-        
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        try:
-            tree = loop.run_until_complete(get_repo_tree(owner, repo, token=token))
-        finally:
-            loop.close()
-
-        if not tree: return "No files."
-        
-        # Simple structure generation
-        paths = [t["path"] for t in tree]
-        return f"Structure for {owner}/{repo}:\n" + "\n".join(sorted(paths))
+        owner, repo, _ = get_repo_context()
+
+        paths = _context_sorted_paths()
+        if not paths:
+            return "No files."
+        return _context_derived(
+            "structure_listing",
+            lambda: _render_directory_structure(owner, repo, paths),
+        )
     except Exception as e:
         return f"Error: {str(e)}"
 
+def _render_directory_structure(owner: str, repo: str, paths: List[str]) -> str:
+    """Render file names grouped under their parent directory."""
+    dirs: defaultdict[str, List[str]] = defaultdict(list)
+    for path in paths:
+        head, _, name = path.rpartition("/")
+        dirs[head].append(name)
+
+    out = io.StringIO()
+    write = out.write
+    write(f"Structure for {owner}/{repo}:")
+    for directory in sorted(dirs):
+        write("\n" + directory + "/" if directory else "\n/ (root)")
+        for name in dirs[directory]:
+            write("\n  - ")
+            write(name)
+    return out.getvalue()
+
+@tool("List files in directory")
+def list_directory_files(directory: str) -> str:
+    """Lists the files and subdirectories directly inside a repository directory."""
+    try:
+        owner, repo, _ = get_repo_context()
+        node = _context_trie()
+
+        directory = directory.strip().strip("/")
+        for segment in directory.split("/") if directory else []:
+            node = node.get(segment) if node else None
+            if node is None:
+                return f"Directory not found: {directory}"
+
+        if not node:
+            return f"Directory {directory or '/'} is empty."
+
+        entries = sorted(name + "/" if child is not None else name for name, child in node.items())
+        return f"Contents of {owner}/{repo}/{directory}:\n" + "\n".join(f"  - {e}" for e in entries)
+    except Exception as e:
+        return f"Error listing directory {directory}: {str(e)}"
+
+@tool("Search files by name")
+def search_files(pattern: str) -> str:
+    """Finds files whose path contains the given text (case-insensitive)."""
+    try:
+        owner, repo, _ = get_repo_context()
+        needle = pattern.lower()
+        matches = sorted(path for lower, path in _context_paths_lower() if needle in lower)
+
+        if not matches:
+            return f"No files matching '{pattern}' in {owner}/{repo}."
+        return f"Files matching '{pattern}':\n" + "\n".join(f"  - {m}" for m in matches)
+    except Exception as e:
+        return f"Error searching files: {str(e)}"
+
 @tool("Read file content")
 def read_file(file_path: str) -> str:
     """Reads the content of a specific file."""
     try:
         owner, repo, token = get_repo_context()
 
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        try:
-            content = loop.run_until_complete(get_file(owner, repo, file_path, token=token))
-        finally:
-            loop.close()
+        staged = _staged_changes()
+        if file_path in staged:
+            content = staged[file_path]
+            if content is None:
+                return f"File {file_path} has been deleted by this plan."
+            return f"Content of {file_path}:\n---\n{content}\n---"
+
+        content = _cached_blob(owner, repo, _context_sha_index().get(file_path))
+        if content is None:
+            blob = _run_async(get_file_blob(owner, repo, file_path, token=token))
+            content = blob["text"]
+            _cache_blob(owner, repo, blob["sha"], content)
 
         return f"Content of {file_path}:\n---\n{content}\n---"
     except Exception as e:
         return f"Error reading file {file_path}: {str(e)}"
 
+@tool("Read multiple files")
+def read_files(file_paths: List[str]) -> str:
+    """Reads the content of several files at once. Prefer this over repeated single reads."""
+    try:
+        owner, repo, token = get_repo_context()
+        sha_index = _context_sha_index()
+        staged = _staged_changes()
+
+        contents: Dict[str, str] = {}
+        missing: List[str] = []
+        for path in file_paths:
+            if path in staged:
+                # Deleted by this plan when None: reported as unreadable below
+                if staged[path] is not None:
+                    contents[path] = staged[path]
+                continue
+            cached = _cached_blob(owner, repo, sha_index.get(path))
+            if cached is not None:
+                contents[path] = cached
+            else:
+                missing.append(path)
+
+        if missing:
+            fetched = _run_async(get_files_batch(owner, repo, missing, token=token))
+            for path, blob in fetched.items():
+                _cache_blob(owner, repo, blob["sha"], blob["text"])
+                contents[path] = blob["text"]
+
+        parts = []
+        for path in file_paths:
+            if path in contents:
+                parts.append(f"Content of {path}:\n---\n{contents[path]}\n---")
+            else:
+                parts.append(f"Could not read {path} (missing or binary file)")
+        return "\n\n".join(parts)
+    except Exception as e:
+        return f"Error reading files: {str(e)}"
+
 @tool("Get repository summary")
 def get_repository_summary() -> str:
     """Provides a comprehensive summary of the repository."""
     try:
-        owner, repo, token = get_repo_context()
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        try:
-            tree = loop.run_until_complete(get_repo_tree(owner, repo, token=token))
-        finally:
-            loop.close()
-            
-        return f"Summary for {owner}/{repo}: {len(tree)} files found."
+        owner, repo, _ = get_repo_context()
+        summary = _context_files_summary()
+
+        parts = [f"Summary for {owner}/{repo}: {summary['total_files']} files found."]
+        if summary["extensions"]:
+            top = ", ".join(
+                f"{ext} ({count})" for ext, count in summary["extensions"].most_common(10)
+            )
+            parts.append(f"Most common file types: {top}")
+        return "\n".join(parts)
     except Exception as e:
         return f"Error: {str(e)}"
 
 # Export tools
-REPOSITORY_TOOLS = [list_repository_files, get_directory_structure, read_file, get_repository_summary]
\ No newline at end of file
+REPOSITORY_TOOLS = [
+    list_repository_files,
+    get_directory_structure,
+    list_directory_files,
+    search_files,
+    read_file,
+    read_files,
+    get_repository_summary,
+]
\ No newline at end of file
@@ -2,27 +2,85 @@ from __future__ import annotations
 
 import asyncio
 import contextvars
+import functools
+import json
 import logging
+import os
+import posixpath
+import re
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import UTC, datetime
+from pathlib import Path
+from string import Template
 from textwrap import dedent
-from typing import List, Literal
+from types import MappingProxyType
+from typing import Any, Callable, Dict, List, Literal, Mapping, Tuple, TypeVar
 
 from crewai import Agent, Crew, Process, Task
-from pydantic import BaseModel, Field
-
+from fastapi import HTTPException
+from pydantic import BaseModel, ConfigDict, Field, TypeAdapter, ValidationError
+
+from . import plan_cache
+from .agent_tools import (
+    REPOSITORY_TOOLS,
+    get_repository_context_summary,
+    invalidate_repo_tree,
+    set_repo_context,
+)
+from .github_api import (
+    commit_changes,
+    delete_file,
+    get_file,
+    get_file_blob,
+    get_repo_tree,
+    put_file,
+)
 from .llm_provider import build_llm
-from .agent_tools import REPOSITORY_TOOLS, set_repo_context, get_repository_context_summary
 
 logger = logging.getLogger(__name__)
 
+_T = TypeVar("_T")
+
+# Upper bound on files generated at once within a plan run; keeps bursts of
+# LLM requests below provider rate limits. Across runs, the crew pool below
+# is the process-wide cap.
+MAX_CONCURRENT_FILES = int(os.getenv("GITPILOT_LLM_CONCURRENCY", "8"))
+
+# Crews run synchronously (blocking on LLM calls), so they get a pool of their
+# own instead of occupying the default executor used by asyncio.to_thread
+_CREW_EXECUTOR = ThreadPoolExecutor(
+    max_workers=int(os.getenv("GITPILOT_CREW_WORKERS", "8")),
+    thread_name_prefix="gitpilot-crew",
+)
+
+# CrewAI's verbose mode prints every LLM turn and tool call; keep it for
+# debugging. GITPILOT_VERBOSE turns it on alone, GITPILOT_DEBUG implies it.
+_VERBOSE = any(
+    os.getenv(name, "").lower() in {"1", "true", "yes"}
+    for name in ("GITPILOT_VERBOSE", "GITPILOT_DEBUG")
+)
+
+
+# Plans are shared through plan_cache, so they are immutable once validated.
+# Keys the model adds beyond the schema are dropped, and stray whitespace
+# around paths is trimmed so they match the repository tree.
+_PLAN_MODEL_CONFIG = ConfigDict(frozen=True, extra="ignore", str_strip_whitespace=True)
+
 
 class PlanFile(BaseModel):
     """Represents a file operation in a plan step."""
+    model_config = _PLAN_MODEL_CONFIG
+
     path: str
     action: Literal["CREATE", "MODIFY", "DELETE", "READ"] = "MODIFY"
 
 
 class PlanStep(BaseModel):
     """A single step in the execution plan."""
+    model_config = _PLAN_MODEL_CONFIG
+
     step_number: int
     title: str
     description: str
@@ -33,17 +91,63 @@ class PlanStep(BaseModel):
 
 class PlanResult(BaseModel):
     """The complete execution plan."""
+    model_config = _PLAN_MODEL_CONFIG
+
     goal: str
     summary: str
     steps: List[PlanStep]
 
 
-async def generate_plan(goal: str, repo_full_name: str, token: str | None = None) -> PlanResult:
+# Built once so parsing the planner answer does not rebuild the validator
+_PLAN_ADAPTER = TypeAdapter(PlanResult)
+
+# Rendered once and inlined into the planner task instead of letting CrewAI
+# regenerate it from output_pydantic on every run
+_PLAN_SCHEMA_JSON = json.dumps(PlanResult.model_json_schema(), separators=(",", ":"))
+
+
+class BatchFilesResult(BaseModel):
+    """Generated contents for several files of one plan step, keyed by path."""
+    files: Dict[str, str] = Field(default_factory=dict)
+
+
+async def _kickoff(crew: Crew, inputs: dict | None = None):
+    """Run a crew on the crew pool without blocking the event loop.
+
+    The current context (and with it the request token) is carried over to
+    the worker thread.
+    """
+    ctx = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(
+        _CREW_EXECUTOR, functools.partial(ctx.run, crew.kickoff, inputs)
+    )
+
+
+def _crew_text(result) -> str:
+    """Return the raw text of a CrewOutput (or the str() of anything else)."""
+    raw = getattr(result, "raw", None)
+    return raw if raw is not None else str(result)
+
+
+def _crew_pydantic(result, model: type[BaseModel]) -> Any:
+    """Return the structured output of a CrewOutput if it is a ``model``."""
+    value = getattr(result, "pydantic", None)
+    return value if isinstance(value, model) else None
+
+
+async def generate_plan(
+    goal: str, repo_full_name: str, token: str | None = None, refresh: bool = False
+) -> PlanResult:
     """Agentic planning: create a structured plan but DO NOT modify the repo.
 
     This function uses a two-phase approach:
-    1. First, explore and understand the repository
+    1. First, collect the repository state (file tree, key files, layout)
     2. Then, create a plan based on actual repository state
+
+    Phase 1 needs no reasoning, so it is plain code over the cached file
+    tree; only phase 2 involves the LLM. Plans are cached per file tree, so
+    repeating an (almost) identical goal on an unchanged repository skips
+    phase 2 as well; ``refresh`` bypasses that cache and replaces the entry.
     """
     llm = build_llm()
 
@@ -61,79 +165,223 @@ async def generate_plan(goal: str, repo_full_name: str, token: str | None = None
         repo_context_data.get("total_files", 0),
     )
 
-    # Create explorer agent
-    explorer = Agent(
-        role="Repository Explorer",
-        goal="Thoroughly explore and document the current state of the repository",
-        backstory=(
-            "You are a meticulous code archaeologist who explores repositories "
-            "to understand their complete structure before any changes are made. "
-            "You use all available tools to build a comprehensive picture."
-        ),
-        llm=llm,
-        tools=REPOSITORY_TOOLS,
-        verbose=True,
-        allow_delegation=False,
-    )
-
-    # Exploration task - gather ALL repository information
-    explore_task = Task(
-        description=dedent(f"""
-            Repository: {repo_full_name}
-
-            Your mission is to THOROUGHLY explore this repository and document its current state.
-            You MUST use your tools to gather the following information:
-
-            1. Call "Get repository summary" - to get overall statistics
-            2. Call "List all files in repository" - to see EVERY file that exists
-            3. Call "Get directory structure" - to understand the organization
-            4. If there are key files (README.md, package.json, etc.), read them
-
-            CRITICAL: You must ACTUALLY CALL these tools. Do not make assumptions.
-
-            After exploring, provide a detailed report in this EXACT format:
+    # A goal already planned against this exact file tree gets the same plan
+    # (unless the caller asked for a fresh one)
+    tree_sha = repo_context_data.get("tree_sha")
+    if tree_sha and not refresh:
+        cached = await plan_cache.lookup(repo_full_name, tree_sha, goal, PlanResult)
+        if cached is not None:
+            logger.info("[GitPilot] Reusing cached plan for an equivalent goal")
+            return cached
 
-            REPOSITORY EXPLORATION REPORT
-            =============================
-
-            Files Found: [list all file paths you discovered]
-
-            Key Files: [list important files like README.md, .gitignore, etc.]
+    # PHASE 2: Create the plan using the exploration context
+    logger.info("[GitPilot] Phase 2: Creating plan based on repository exploration...")
+    exploration_report = _format_exploration_report(repo_context_data)
+    plan = await _run_planner(llm, repo_full_name, exploration_report, goal)
+    if tree_sha:
+        await plan_cache.store(repo_full_name, tree_sha, goal, plan)
+    return plan
+
+
+# Prompt templates are dedented once at import time. Every prompt puts its
+# static instructions first and the per-call values last, so providers that
+# cache identical prompt prefixes can reuse the instructions across calls.
+# The planner prompt keeps a literal {goal} placeholder, which CrewAI fills
+# from the kickoff inputs.
+_PLAN_TEMPLATE = Template(dedent("""
+    Create a plan for the user goal given at the end, based on the ACTUAL files listed in the exploration report that follows these rules.
+
+    CRITICAL RULES FOR ANALYSIS AND GENERATION TASKS:
+    - If the goal mentions "analyze" or "generate" or "create examples/demos", you MUST create NEW files
+    - When the user asks to "analyze X and create Y":
+      * Step 1: Use "Read file content" tool to analyze existing files (if needed)
+      * Step 2: Plan CREATE actions for new files (e.g., demo.py, example.py, tutorial.md)
+    - NEW files can include: Python scripts, examples, demos, tutorials, documentation
+    - Examples of analysis tasks that should CREATE files:
+      * "analyze README and generate Python code" → CREATE: demo.py, example.py
+      * "create demo based on documentation" → CREATE: demo.py, test_example.py
+      * "generate tutorial from existing code" → CREATE: tutorial.md, examples/
+    - IMPORTANT: Empty plans (steps: []) are ONLY acceptable if the goal is purely informational
+    - If the user wants something generated/created, you MUST include CREATE actions
+
+    CRITICAL RULES FOR DELETION SCENARIOS:
+    - If the goal mentions "delete files" or "keep only", you MUST identify which files to DELETE
+    - For EACH file in the exploration report:
+      * If it should be KEPT (e.g., README.md if goal says "keep README.md"), do NOT include it in the plan
+      * If it should be DELETED (e.g., all other files), mark it with action "DELETE"
+    - ONLY delete files that actually exist (check the exploration report)
+    - NEVER delete files that the user wants to keep
+    - Be explicit: if the goal is "delete all files except README.md", then:
+      * README.md should NOT appear in your plan (it's being kept)
+      * ALL other files from the exploration report should have action "DELETE"
+
+    CRITICAL RULES FOR VERIFICATION:
+    - ONLY include files that appear in the exploration report
+    - For "CREATE" actions: file must NOT be in the exploration report
+    - For "MODIFY" or "DELETE" actions: file MUST be in the exploration report
+    - If you're unsure, you can still call your tools to double-check
+
+    Your FINAL ANSWER must be a single JSON object that matches exactly this schema:
+
+    {
+      "goal": "string describing the goal",
+      "summary": "string with overall plan summary",
+      "steps": [
+        {
+          "step_number": 1,
+          "title": "Step title",
+          "description": "What this step does",
+          "files": [
+            {"path": "file/path.py", "action": "CREATE"},
+            {"path": "another/file.py", "action": "MODIFY"},
+            {"path": "old/file.py", "action": "DELETE"},
+            {"path": "README.md", "action": "READ"}
+          ],
+          "risks": "Optional risk description or null"
+        }
+      ]
+    }
 
-            Directory Structure: [describe the folder organization]
+    CRITICAL JSON RULES:
+    - Output MUST be valid JSON.
+    - STRICTLY NO COMMENTS allowed (no // or #).
+    - Double quotes around all keys and string values.
+    - No trailing commas.
+    - "action" MUST be exactly one of: "CREATE", "MODIFY", "DELETE", "READ"
+    - "step_number" MUST be an integer starting from 1
+    - "risks" can be either a string or null (the JSON null value, without quotes)
+    - Do NOT wrap the JSON in markdown code fences
+    - Do NOT add any explanation before or after the JSON
+    - The ENTIRE response MUST be ONLY the JSON object, starting with '{' and ending with '}'
+
+    EXAMPLE 1 - Analysis and Generation:
+    Goal: "analyze README.md and generate Python code to explain the content"
+    Exploration found: ["README.md"]
+    Your plan should:
+      Step 1: "Analyze README.md content and generate demonstration code"
+        Files: [
+          {"path": "demo.py", "action": "CREATE"},
+          {"path": "example.py", "action": "CREATE"}
+        ]
+
+    EXAMPLE 2 - Deletion:
+    Goal: "delete all files except README.md"
+    Exploration found: ["README.md", "old_file.py", "test.txt"]
+    Your plan should DELETE: old_file.py, test.txt
+    Your plan should NOT mention: README.md (it's being kept)
+
+    EXAMPLE 3 - Tutorial Creation:
+    Goal: "create a tutorial based on the existing code"
+    Exploration found: ["src/main.py", "README.md"]
+    Your plan should:
+      Step 1: "Create comprehensive tutorial files"
+        Files: [
+          {"path": "docs/tutorial.md", "action": "CREATE"},
+          {"path": "examples/basic_example.py", "action": "CREATE"},
+          {"path": "examples/advanced_example.py", "action": "CREATE"}
+        ]
+
+    REPOSITORY EXPLORATION REPORT (CRITICAL CONTEXT):
+    ==================================================
+    $exploration_report
+    ==================================================
+
+    Repository: $repo_full_name
+    User goal: {goal}
+"""))
+
+_PLAN_EXPECTED_OUTPUT = dedent("""
+    A single valid JSON object matching the PlanResult schema:
+    - goal: string
+    - summary: string
+    - steps: array of objects, each with:
+      - step_number: integer
+      - title: string
+      - description: string
+      - files: array of { "path": string, "action": "CREATE" | "MODIFY" | "DELETE" | "READ" }
+      - risks: string or null
+    The response must contain ONLY pure JSON (no markdown, no prose, no code fences, NO COMMENTS).
+
+    IMPORTANT:
+    - For analysis/generation tasks: Include CREATE actions for new files (demos, examples, tutorials)
+    - For deletion scenarios: Only include files that should be DELETED or MODIFIED
+    - Empty steps array is ONLY acceptable if the goal is purely informational (no action needed)
+    - If the user wants content generated/created, steps array MUST contain CREATE actions
+
+    JSON schema of the expected answer:
+""") + _PLAN_SCHEMA_JSON
+
+
+def _path_tree(paths: List[str]) -> List[str]:
+    """Render paths as an indented tree, one line per directory and file.
+
+    Directories that only contain a single subdirectory are merged into one
+    line (``src/gitpilot/``), so deep layouts do not cost a line per level.
+    """
+    root: Dict[str, Any] = {}
+    for path in paths:
+        node = root
+        *dirs, name = path.split("/")
+        for part in dirs:
+            node = node.setdefault(part + "/", {})
+        node.setdefault(name, None)
 
-            File Types: [count files by extension]
+    lines: List[str] = []
 
-            Your report MUST be based on ACTUAL tool calls, not assumptions.
-        """),
-        expected_output="A detailed exploration report listing ALL files found in the repository",
-        agent=explorer,
-    )
+    def render(node: Dict[str, Any], depth: int) -> None:
+        for name, child in sorted(node.items()):
+            label, subtree = name, child
+            while isinstance(subtree, dict) and len(subtree) == 1:
+                (only_name, only_child), = subtree.items()
+                if only_child is None:
+                    break
+                label, subtree = label + only_name, only_child
+            lines.append("  " * depth + label)
+            if subtree:
+                render(subtree, depth + 1)
 
-    explore_crew = Crew(
-        agents=[explorer],
-        tasks=[explore_task],
-        process=Process.sequential,
-        verbose=True,
-    )
+    render(root, 1)
+    return lines
 
-    def _explore():
-        return explore_crew.kickoff()
 
-    # FIX: Propagate context (token) to the thread for CrewAI execution
-    ctx = contextvars.copy_context()
-    exploration_result = await asyncio.to_thread(ctx.run, _explore)
+_TREE_HEADER = "Files Found (tree; a file's path is its directories joined with its name):"
 
-    # Extract exploration report
-    exploration_report = exploration_result.raw if hasattr(exploration_result, "raw") else str(exploration_result)
-    logger.info(
-        "[GitPilot] Exploration complete. Report length: %s chars",
-        len(exploration_report),
-    )
 
-    # PHASE 2: Create the plan using the exploration context
-    logger.info("[GitPilot] Phase 2: Creating plan based on repository exploration...")
+def _format_exploration_report(context: Dict[str, Any]) -> str:
+    """Render a repository context summary as the planner's exploration report.
 
+    "Files Found" is written as a tree when that is shorter than the flat
+    list, so shared directory prefixes are written once instead of per file.
+    """
+    if "error" in context:
+        return (
+            f"Files Found: unavailable ({context['error']}). "
+            "Use your tools to list and read the repository files."
+        )
+
+    all_files = context["all_files"]
+    files_found = [f"Files Found: {', '.join(all_files) or 'none (empty repository)'}"]
+    if len(all_files) > 1:
+        tree = [_TREE_HEADER, *_path_tree(all_files)]
+        # Compared as rendered: the header and one newline per line count
+        if sum(len(line) + 1 for line in tree) < len(files_found[0]):
+            files_found = tree
+
+    directories = ", ".join(sorted(context["directories"])) or "none (all files at root)"
+    file_types = ", ".join(f"{ext}: {count}" for ext, count in context["extensions"].most_common())
+    return "\n".join([
+        *files_found,
+        "",
+        f"Key Files: {', '.join(context['key_files']) or 'none'}",
+        "",
+        f"Directory Structure: top-level directories {directories}",
+        "",
+        f"File Types: {file_types or 'none'}",
+    ])
+
+
+async def _run_planner(llm, repo_full_name: str, exploration_report: str, goal: str) -> PlanResult:
+    """Run the planner crew on an exploration report and return its plan."""
     planner = Agent(
         role="Repository Refactor Planner",
         goal=(
@@ -154,175 +402,137 @@ async def generate_plan(goal: str, repo_full_name: str, token: str | None = None
         ),
         llm=llm,
         tools=REPOSITORY_TOOLS,  # Still has access to verify if needed
-        verbose=True,
+        verbose=_VERBOSE,
         allow_delegation=False,
     )
 
     plan_task = Task(
-        description=dedent(f"""
-            User goal: {{goal}}
-            Repository: {repo_full_name}
-
-            REPOSITORY EXPLORATION REPORT (CRITICAL CONTEXT):
-            ==================================================
-            {exploration_report}
-            ==================================================
-
-            Based on the ACTUAL files listed in the exploration report above, create a plan.
-
-            CRITICAL RULES FOR ANALYSIS AND GENERATION TASKS:
-            - If the goal mentions "analyze" or "generate" or "create examples/demos", you MUST create NEW files
-            - When the user asks to "analyze X and create Y":
-              * Step 1: Use "Read file content" tool to analyze existing files (if needed)
-              * Step 2: Plan CREATE actions for new files (e.g., demo.py, example.py, tutorial.md)
-            - NEW files can include: Python scripts, examples, demos, tutorials, documentation
-            - Examples of analysis tasks that should CREATE files:
-              * "analyze README and generate Python code" → CREATE: demo.py, example.py
-              * "create demo based on documentation" → CREATE: demo.py, test_example.py
-              * "generate tutorial from existing code" → CREATE: tutorial.md, examples/
-            - IMPORTANT: Empty plans (steps: []) are ONLY acceptable if the goal is purely informational
-            - If the user wants something generated/created, you MUST include CREATE actions
-
-            CRITICAL RULES FOR DELETION SCENARIOS:
-            - If the goal mentions "delete files" or "keep only", you MUST identify which files to DELETE
-            - For EACH file in the exploration report:
-              * If it should be KEPT (e.g., README.md if goal says "keep README.md"), do NOT include it in the plan
-              * If it should be DELETED (e.g., all other files), mark it with action "DELETE"
-            - ONLY delete files that actually exist (check the exploration report)
-            - NEVER delete files that the user wants to keep
-            - Be explicit: if the goal is "delete all files except README.md", then:
-              * README.md should NOT appear in your plan (it's being kept)
-              * ALL other files from the exploration report should have action "DELETE"
-
-            CRITICAL RULES FOR VERIFICATION:
-            - ONLY include files that appear in the exploration report
-            - For "CREATE" actions: file must NOT be in the exploration report
-            - For "MODIFY" or "DELETE" actions: file MUST be in the exploration report
-            - If you're unsure, you can still call your tools to double-check
-
-            Your FINAL ANSWER must be a single JSON object that matches exactly this schema:
-
-            {{
-              "goal": "string describing the goal",
-              "summary": "string with overall plan summary",
-              "steps": [
-                {{
-                  "step_number": 1,
-                  "title": "Step title",
-                  "description": "What this step does",
-                  "files": [
-                    {{"path": "file/path.py", "action": "CREATE"}},
-                    {{"path": "another/file.py", "action": "MODIFY"}},
-                    {{"path": "old/file.py", "action": "DELETE"}},
-                    {{"path": "README.md", "action": "READ"}}
-                  ],
-                  "risks": "Optional risk description or null"
-                }}
-              ]
-            }}
-
-            CRITICAL JSON RULES:
-            - Output MUST be valid JSON.
-            - STRICTLY NO COMMENTS allowed (no // or #).
-            - Double quotes around all keys and string values.
-            - No trailing commas.
-            - "action" MUST be exactly one of: "CREATE", "MODIFY", "DELETE", "READ"
-            - "step_number" MUST be an integer starting from 1
-            - "risks" can be either a string or null (the JSON null value, without quotes)
-            - Do NOT wrap the JSON in markdown code fences
-            - Do NOT add any explanation before or after the JSON
-            - The ENTIRE response MUST be ONLY the JSON object, starting with '{{' and ending with '}}'
-
-            EXAMPLE 1 - Analysis and Generation:
-            Goal: "analyze README.md and generate Python code to explain the content"
-            Exploration found: ["README.md"]
-            Your plan should:
-              Step 1: "Analyze README.md content and generate demonstration code"
-                Files: [
-                  {{"path": "demo.py", "action": "CREATE"}},
-                  {{"path": "example.py", "action": "CREATE"}}
-                ]
-
-            EXAMPLE 2 - Deletion:
-            Goal: "delete all files except README.md"
-            Exploration found: ["README.md", "old_file.py", "test.txt"]
-            Your plan should DELETE: old_file.py, test.txt
-            Your plan should NOT mention: README.md (it's being kept)
-
-            EXAMPLE 3 - Tutorial Creation:
-            Goal: "create a tutorial based on the existing code"
-            Exploration found: ["src/main.py", "README.md"]
-            Your plan should:
-              Step 1: "Create comprehensive tutorial files"
-                Files: [
-                  {{"path": "docs/tutorial.md", "action": "CREATE"}},
-                  {{"path": "examples/basic_example.py", "action": "CREATE"}},
-                  {{"path": "examples/advanced_example.py", "action": "CREATE"}}
-                ]
-        """),
-        expected_output=dedent("""
-            A single valid JSON object matching the PlanResult schema:
-            - goal: string
-            - summary: string
-            - steps: array of objects, each with:
-              - step_number: integer
-              - title: string
-              - description: string
-              - files: array of { "path": string, "action": "CREATE" | "MODIFY" | "DELETE" | "READ" }
-              - risks: string or null
-            The response must contain ONLY pure JSON (no markdown, no prose, no code fences, NO COMMENTS).
-
-            IMPORTANT:
-            - For analysis/generation tasks: Include CREATE actions for new files (demos, examples, tutorials)
-            - For deletion scenarios: Only include files that should be DELETED or MODIFIED
-            - Empty steps array is ONLY acceptable if the goal is purely informational (no action needed)
-            - If the user wants content generated/created, steps array MUST contain CREATE actions
-        """),
+        description=_PLAN_TEMPLATE.substitute(
+            repo_full_name=repo_full_name,
+            exploration_report=exploration_report,
+        ),
+        expected_output=_PLAN_EXPECTED_OUTPUT,
         agent=planner,
-        output_pydantic=PlanResult,
     )
 
     plan_crew = Crew(
         agents=[planner],
         tasks=[plan_task],
         process=Process.sequential,
-        verbose=True,
+        verbose=_VERBOSE,
     )
 
-    def _plan():
-        return plan_crew.kickoff(inputs={"goal": goal})
-
-    # FIX: Propagate context to the planning thread
-    ctx = contextvars.copy_context()
-    result = await asyncio.to_thread(ctx.run, _plan)
-
-    # CrewAI returns CrewOutput with .pydantic attribute containing the PlanResult
-    if hasattr(result, "pydantic") and result.pydantic:
-        plan = result.pydantic
-        logger.info("[GitPilot] Plan created with %s steps", len(plan.steps))
-        return plan
-
-    # Fallback: this should not usually happen if output_pydantic is respected
-    logger.warning("[GitPilot] Unexpected planning result type: %r", type(result))
-    return result
-
-
-async def execute_plan(plan: PlanResult, repo_full_name: str, token: str | None = None) -> dict:
-    """Execute the approved plan by applying changes to the GitHub repository.
-
-    Returns an execution log with details about each step.
+    result = await _kickoff(plan_crew, {"goal": goal})
+
+    # Parsed here rather than through output_pydantic, which would have
+    # CrewAI decode and validate the same answer a second time
+    try:
+        plan = _validate_json_answer(_PLAN_ADAPTER.validate_json, _crew_text(result))
+    except ValidationError as e:
+        raise ValueError(f"Planner did not return a valid plan: {e}") from e
+    logger.info("[GitPilot] Plan created with %s steps", len(plan.steps))
+    return plan
+
+
+# Per-file Code Writer prompts. They are filled in with string.Template rather
+# than CrewAI kickoff inputs: file contents are full of braces, which CrewAI
+# would try to interpolate.
+_CREATE_TEMPLATE = Template(dedent("""
+    Generate complete content for the new file named at the end.
+
+    CRITICAL INSTRUCTIONS:
+    - You have access to repository exploration tools - USE THEM!
+    - If the goal mentions 'analyze' or 'based on', first read the relevant files:
+      * Use 'Read file content' to read existing files (README.md, source code, etc.)
+      * Use 'List all files in repository' to see what files exist
+    - Generate content that is INFORMED by the actual repository content
+    - If creating a demo/example, make it relevant to the actual project
+    - If creating documentation, reference actual files and code in the repository
+
+    Requirements:
+    - Create production-ready content appropriate for the file's name and type
+    - If it's a documentation file (.md, .txt, .rst), write comprehensive, well-structured documentation
+    - If it's a code file, include proper imports, comments, and follow best practices
+    - If it's a configuration file, include sensible defaults and comments
+    - Make the content complete and ready to use
+    - Do NOT include placeholder comments like 'TODO' or 'IMPLEMENT THIS'
+    - The content should be fully functional and informative
+
+    Return ONLY the file content, no explanations or markdown code blocks.
+
+    Overall Goal: $goal
+    Step Context: $step_context
+    File: $path
+""").strip())
+
+_MODIFY_TEMPLATE = Template(dedent("""
+    Modify the existing file named at the end; its current content is given last.
+
+    Requirements:
+    - Make the changes described in the step context
+    - Preserve the existing structure and format
+    - For documentation: update or add relevant sections
+    - For code: add/modify functions, imports, or logic as needed
+    - Ensure the result is complete and functional
+    - Do NOT just add comments - make real, substantive changes
+
+    Return ONLY the complete modified file content, no explanations.
+
+    Overall Goal: $goal
+    Step Context: $step_context
+    File: $path
+
+    Current File Content:
+    ---
+    $existing
+    ---
+""").strip())
+
+# Batched variants: several files of one step in a single kickoff, answered
+# as a BatchFilesResult JSON object
+_BATCH_CREATE_TEMPLATE = Template(dedent("""
+    Generate complete content for each of the new files listed at the end.
+
+    CRITICAL INSTRUCTIONS:
+    - You have access to repository exploration tools - USE THEM!
+    - If the goal mentions 'analyze' or 'based on', first read the relevant files
+    - Generate content that is INFORMED by the actual repository content
+    - Each file must be production-ready and appropriate for its file type
+    - Do NOT include placeholder comments like 'TODO' or 'IMPLEMENT THIS'
+
+    Return ONLY a JSON object of the form {"files": {"<path>": "<complete file content>"}} with one entry per listed file.
+
+    Overall Goal: $goal
+    Step Context: $step_context
+    Files:
+    $paths
+""").strip())
+
+_BATCH_MODIFY_TEMPLATE = Template(dedent("""
+    Modify each of the existing files given at the end.
+
+    Requirements:
+    - Make the changes described in the step context
+    - Preserve the existing structure and format of each file
+    - Ensure every result is complete and functional
+    - Do NOT just add comments - make real, substantive changes
+
+    Return ONLY a JSON object of the form {"files": {"<path>": "<complete modified content>"}} with one entry per file.
+
+    Overall Goal: $goal
+    Step Context: $step_context
+
+    $files
+""").strip())
+
+
+def _build_code_writer(llm) -> Agent:
+    """Create a Code Writer agent.
+
+    Each file gets its own agent: CrewAI keeps per-run executor state on the
+    Agent, so one instance must not be shared by concurrently running crews.
     """
-    from .github_api import get_file, put_file
-
-    owner, repo = repo_full_name.split("/")
-    execution_steps: list[dict] = []
-    llm = build_llm()
-
-    # Set repository context for tools (in case Code Writer needs them)
-    set_repo_context(owner, repo, token=token)
-
-    # Create a Code Writer agent that generates actual content
-    code_writer = Agent(
+    return Agent(
         role="Expert Code Writer",
         goal="Generate high-quality, production-ready code and documentation based on requirements.",
         backstory=(
@@ -338,184 +548,594 @@ async def execute_plan(plan: PlanResult, repo_full_name: str, token: str | None
         ),
         llm=llm,
         tools=REPOSITORY_TOOLS,  # Give Code Writer access to repository tools
-        verbose=True,  # Enable verbose to see tool usage
+        verbose=_VERBOSE,  # Set GITPILOT_VERBOSE=1 to see tool usage
         allow_delegation=False,
     )
 
-    for step in plan.steps:
-        step_summary = f"Step {step.step_number}: {step.title}"
 
-        for file in step.files:
-            try:
-                if file.action == "CREATE":
-                    # Use LLM to generate appropriate content for the new file
-                    create_task = Task(
-                        description=(
-                            f"Generate complete content for a new file: {file.path}\n\n"
-                            f"Overall Goal: {plan.goal}\n"
-                            f"Step Context: {step.description}\n\n"
-                            "CRITICAL INSTRUCTIONS:\n"
-                            "- You have access to repository exploration tools - USE THEM!\n"
-                            "- If the goal mentions 'analyze' or 'based on', first read the relevant files:\n"
-                            "  * Use 'Read file content' to read existing files (README.md, source code, etc.)\n"
-                            "  * Use 'List all files in repository' to see what files exist\n"
-                            "- Generate content that is INFORMED by the actual repository content\n"
-                            "- If creating a demo/example, make it relevant to the actual project\n"
-                            "- If creating documentation, reference actual files and code in the repository\n\n"
-                            "Requirements:\n"
-                            f"- Create production-ready content appropriate for {file.path}\n"
-                            "- If it's a documentation file (.md, .txt, .rst), write comprehensive, well-structured documentation\n"
-                            "- If it's a code file, include proper imports, comments, and follow best practices\n"
-                            "- If it's a configuration file, include sensible defaults and comments\n"
-                            "- Make the content complete and ready to use\n"
-                            "- Do NOT include placeholder comments like 'TODO' or 'IMPLEMENT THIS'\n"
-                            "- The content should be fully functional and informative\n\n"
-                            "Return ONLY the file content, no explanations or markdown code blocks."
-                        ),
-                        expected_output=f"Complete, production-ready content for {file.path}",
-                        agent=code_writer,
-                    )
+def _solo_crew(task: Task) -> Crew:
+    """Wrap a single Code Writer task in its own quiet crew."""
+    return Crew(
+        agents=[task.agent],
+        tasks=[task],
+        process=Process.sequential,
+        verbose=False,
+    )
+
+
+def _strip_fences(content: str) -> str:
+    """Clean up any markdown code block that might wrap generated content."""
+    content = content.strip()
+    if not content.startswith("```"):
+        return content
+    # Only the first and last lines are inspected; the body is sliced once
+    _, _, body = content.partition("\n")
+    head, _, last = body.rpartition("\n")
+    return head if last.strip() == "```" else body
+
+
+def _validate_json_answer(validate: Callable[[str], _T], answer: str) -> _T:
+    """Validate a model's JSON answer, tolerating prose around the object.
+
+    The (fence-stripped) answer is validated as is first; only if that fails
+    is the outermost ``{...}`` in it tried, for answers like
+    "Here is the plan: {...}".
+    """
+    text = _strip_fences(answer)
+    try:
+        return validate(text)
+    except ValidationError:
+        start, end = text.find("{"), text.rfind("}") + 1
+        if start < 0 or end <= start or (start, end) == (0, len(text)):
+            raise
+        return validate(text[start:end])
+
+
+@dataclass
+class _PlanRun:
+    """State shared by every file operation of one execute_plan call."""
+
+    plan: PlanResult
+    owner: str
+    repo: str
+    token: str | None
+    llm: Any
+    limiter: asyncio.Semaphore = field(
+        default_factory=lambda: asyncio.Semaphore(MAX_CONCURRENT_FILES)
+    )
+    # Commits to the same branch must not race each other
+    write_lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    # Current {"sha", "text"} of files the plan touches, kept up to date as
+    # files are staged so later steps build on earlier ones
+    sources: Dict[str, Dict[str, str]] = field(default_factory=dict)
+    # Paths known to exist on the branch before the run (the prefetched ones)
+    existing: set[str] = field(default_factory=set)
+    # Pending changes, committed together at the end of the run: path ->
+    # new content, or None for a deletion
+    staged: Dict[str, str | None] = field(default_factory=dict)
+    messages: List[str] = field(default_factory=list)
+    # In-flight or finished single-file CREATE generations keyed by
+    # (path, step description), i.e. by everything their prompt depends on
+    creations: Dict[Tuple[str, str], asyncio.Future] = field(default_factory=dict)
+
+    def stage_write(self, path: str, content: str, message: str) -> None:
+        """Queue ``content`` to be written to ``path`` by the run's commit."""
+        self.staged[path] = content
+        # The blob sha is unknown until the commit exists
+        self.sources[path] = {"sha": "", "text": content}
+        self.messages.append(message)
+
+    def stage_delete(self, path: str, message: str) -> None:
+        """Queue the removal of ``path``, which must exist on the branch."""
+        self.staged[path] = None
+        self.sources.pop(path, None)
+        self.messages.append(message)
+
+    def commit_message(self) -> str:
+        return f"GitPilot: {self.plan.goal}\n\n" + "\n".join(f"- {m}" for m in self.messages)
+
+
+# Files whose content is fixed by convention; creating them needs no LLM.
+_STATIC_FILES: Dict[str, str] = {
+    "__init__.py": "",
+    "py.typed": "",
+    ".gitkeep": "",
+    ".keep": "",
+    ".nojekyll": "",
+}
+
+# An __init__.py is only left empty when nothing asks it to expose anything
+_INIT_CONTENT_RE = re.compile(
+    r"\b(?:(?:re-?)?export(?:s|ing)?|expos(?:e[sd]?|ing)|imports?|importing|public api)\b"
+    r"|__all__|__version__",
+    re.IGNORECASE,
+)
+
+# License texts must be reproduced verbatim, so the MIT license comes from a
+# packaged template rather than from the model. Any other license mentioned
+# alongside it (e.g. "switch from MIT to Apache") leaves the file to the LLM.
+# The copyright holder is whoever the goal or step names ("copyright holder
+# Acme Corp", "Copyright (c) 2024 Jane Doe"); the repository owner may be an
+# organization or a fork, so without a name the template's placeholder stays.
+_TEMPLATES_DIR = Path(__file__).resolve().parent / "templates"
+_LICENSE_FILES = {"LICENSE", "LICENSE.md", "LICENSE.txt"}
+_MIT_RE = re.compile(r"\bMIT\b")
+_OTHER_LICENSE_RE = re.compile(r"\b(?:Apache|A?GPL|LGPL|BSD|MPL|ISC|Unlicense)\b", re.IGNORECASE)
+_HOLDER_RE = re.compile(
+    r"(?:\bcopyright\s+(?:holder|owner)s?|\bcopyright\s*(?:\(c\)|©|by)|©|\bcopyright\s+(?=\d{4}\b))"
+    r"\s*(?:is\b|are\b|:)?\s*(?:\d{4}\s+)?[\"'“]?"
+    r"(?P<holder>[^\"'”\n,;()]+?)[\"'”]?\s*(?=[\n,;()]|\.\s|\.?$)",
+    re.IGNORECASE,
+)
+_HOLDER_PLACEHOLDER = "<copyright holders>"
+
+
+@functools.cache
+def _license_template(name: str) -> Template:
+    return Template((_TEMPLATES_DIR / f"LICENSE-{name}").read_text(encoding="utf-8"))
+
+
+def _static_license(run: _PlanRun, step: PlanStep) -> str | None:
+    """MIT license text, if that is what is asked for."""
+    text = f"{run.plan.goal}\n{step.description}"
+    if not _MIT_RE.search(text) or _OTHER_LICENSE_RE.search(text):
+        return None
+    match = _HOLDER_RE.search(text)
+    holder = match.group("holder").strip() if match else _HOLDER_PLACEHOLDER
+    year = datetime.now(UTC).year
+    return _license_template("MIT").substitute(year=year, holder=holder)
+
+
+def _static_content(run: _PlanRun, step: PlanStep, path: str) -> str | None:
+    """Content for a conventional marker or license file, or None to generate it.
+
+    A marker file the goal or step names explicitly is generated anyway,
+    since the user evidently cares what goes into it; so is an __init__.py
+    whose goal or step talks about exports or imports.
+    """
+    name = posixpath.basename(path)
+    text = f"{run.plan.goal}\n{step.description}"
+    if name in _LICENSE_FILES:
+        content = _static_license(run, step)
+    elif (
+        name not in _STATIC_FILES
+        or name in text
+        or (name == "__init__.py" and _INIT_CONTENT_RE.search(text))
+    ):
+        content = None
+    else:
+        content = _STATIC_FILES[name]
+    if content is not None:
+        logger.debug("[GitPilot] Using static content for %s", path)
+    return content
+
+
+async def _generate_batch(task: Task, paths: List[str]) -> Dict[str, str]:
+    """Run a batch generation task and return the contents it produced.
+
+    Only paths that were requested are kept; anything the model skipped is
+    left to the per-file fallback in _process_file.
+    """
+    result = await _kickoff(_solo_crew(task))
+
+    batch = _crew_pydantic(result, BatchFilesResult)
+    if batch is None:
+        try:
+            batch = _validate_json_answer(BatchFilesResult.model_validate_json, _crew_text(result))
+        except ValueError:
+            logger.warning("[GitPilot] Batch generation returned unparseable output")
+            return {}
+
+    wanted = set(paths)
+    return {
+        path: _strip_fences(content)
+        for path, content in batch.files.items()
+        if path in wanted
+    }
+
 
-                    def _create():
-                        crew = Crew(
-                            agents=[code_writer],
-                            tasks=[create_task],
-                            process=Process.sequential,
-                            verbose=False,
-                        )
-                        result = crew.kickoff()
-                        # Extract the raw output from CrewOutput
-                        if hasattr(result, "raw"):
-                            return result.raw
-                        return str(result)
-
-                    # FIX: Propagate context to the creation thread
-                    ctx = contextvars.copy_context()
-                    content = await asyncio.to_thread(ctx.run, _create)
-
-                    # Clean up any markdown code blocks that might be included
-                    content = content.strip()
-                    if content.startswith("```"):
-                        lines = content.split("\n")
-                        if lines[-1].strip() == "```":
-                            content = "\n".join(lines[1:-1])
-                        else:
-                            content = "\n".join(lines[1:])
+async def _generate_step_contents(run: _PlanRun, step: PlanStep) -> Dict[str, str]:
+    """Generate contents for every CREATE and MODIFY file of a step.
 
+    CREATE files with the same extension share one Crew kickoff and all MODIFY
+    files share another, instead of one kickoff per file.
+    """
+    generated: Dict[str, str] = {}
+    create_paths = []
+    for path in dict.fromkeys(file.path for file in step.files if file.action == "CREATE"):
+        static = _static_content(run, step, path)
+        if static is not None:
+            generated[path] = static
+        else:
+            create_paths.append(path)
+    modify_paths = []
+    for file in step.files:
+        if file.action != "MODIFY":
+            continue
+        remembered = _recall_modify(run, step, file.path)
+        if remembered is not None:
+            generated[file.path] = remembered
+        else:
+            modify_paths.append(file.path)
+    batches = []
+
+    # Files of the same kind share conventions, so each extension gets its own
+    # batch; a lone file of its kind is generated on its own in _process_file.
+    creates_by_ext: Dict[str, List[str]] = defaultdict(list)
+    for path in create_paths:
+        creates_by_ext[posixpath.splitext(path)[1].lower()].append(path)
+
+    for bucket in creates_by_ext.values():
+        if len(bucket) < 2:
+            continue
+
+        batch_create_task = Task(
+            description=_BATCH_CREATE_TEMPLATE.substitute(
+                paths="\n".join(f"- {path}" for path in bucket),
+                goal=run.plan.goal,
+                step_context=step.description,
+            ),
+            expected_output="A JSON object mapping every requested path to its complete content",
+            agent=_build_code_writer(run.llm),
+            output_pydantic=BatchFilesResult,
+        )
+        batches.append((batch_create_task, bucket))
+
+    if len(modify_paths) > 1:
+        # Files that could not be prefetched go through the per-file path,
+        # which reports the error for that file.
+        existing = {path: run.sources[path]["text"] for path in modify_paths if path in run.sources}
+        if len(existing) > 1:
+            batch_modify_task = Task(
+                description=_BATCH_MODIFY_TEMPLATE.substitute(
+                    goal=run.plan.goal,
+                    step_context=step.description,
+                    files="\n\n".join(
+                        f"Current content of {path}:\n---\n{content}\n---"
+                        for path, content in existing.items()
+                    ),
+                ),
+                expected_output=(
+                    "A JSON object mapping every file path to its complete modified content"
+                ),
+                agent=_build_code_writer(run.llm),
+                output_pydantic=BatchFilesResult,
+            )
+            batches.append((batch_modify_task, list(existing)))
+
+    async def _limited(task: Task, paths: List[str]) -> Dict[str, str]:
+        async with run.limiter:
+            return await _generate_batch(task, paths)
+
+    for result in await asyncio.gather(
+        *(_limited(task, paths) for task, paths in batches),
+        return_exceptions=True,
+    ):
+        if isinstance(result, BaseException):
+            logger.warning("[GitPilot] Batch generation failed: %s", result)
+            continue
+        generated.update(result)
+        for path, content in result.items():
+            if path in modify_paths:
+                _remember_modify(run, step, path, content)
+    return generated
+
+
+# Generated MODIFY results keyed by the source blob sha and the instructions
+# that produced them, so re-running a step on an unchanged file (e.g. after a
+# failed commit) does not ask the LLM again.
+_MODIFY_MEMO: OrderedDict[Tuple[str, ...], str] = OrderedDict()
+_MODIFY_MEMO_SIZE = 256
+
+
+def _modify_memo_key(run: _PlanRun, step: PlanStep, path: str) -> Tuple[str, ...] | None:
+    sha = (run.sources.get(path) or {}).get("sha")
+    if not sha:
+        return None
+    return (run.owner, run.repo, path, sha, run.plan.goal, step.description)
+
+
+def _recall_modify(run: _PlanRun, step: PlanStep, path: str) -> str | None:
+    key = _modify_memo_key(run, step, path)
+    if key is None or key not in _MODIFY_MEMO:
+        return None
+    _MODIFY_MEMO.move_to_end(key)
+    return _MODIFY_MEMO[key]
+
+
+def _remember_modify(run: _PlanRun, step: PlanStep, path: str, content: str) -> None:
+    key = _modify_memo_key(run, step, path)
+    if key is None:
+        return
+    _MODIFY_MEMO[key] = content
+    _MODIFY_MEMO.move_to_end(key)
+    while len(_MODIFY_MEMO) > _MODIFY_MEMO_SIZE:
+        _MODIFY_MEMO.popitem(last=False)
+
+
+async def _prefetch_sources(run: _PlanRun) -> None:
+    """Fetch every file the plan modifies or deletes in one concurrent wave.
+
+    Files that cannot be read are left out; they are fetched (and their
+    errors reported) per file when their step runs.
+    """
+    paths = list(dict.fromkeys(
+        file.path
+        for step in run.plan.steps
+        for file in step.files
+        if file.action in ("MODIFY", "DELETE")
+    ))
+    fetched = await asyncio.gather(
+        *(get_file_blob(run.owner, run.repo, path, token=run.token) for path in paths),
+        return_exceptions=True,
+    )
+    run.sources.update(
+        (path, blob)
+        for path, blob in zip(paths, fetched, strict=True)
+        if not isinstance(blob, BaseException)
+    )
+
+
+async def _process_create(
+    run: _PlanRun, step: PlanStep, file: PlanFile, content: str | None
+) -> str:
+    """Create a new file, generating its content unless it was batched.
+
+    A plan that lists the same CREATE twice with the same context (within a
+    step or across steps) shares one generation.
+    """
+    key = (file.path, step.description)
+    if content is None and key not in run.creations:
+        # Use LLM to generate appropriate content for the new file
+        create_task = Task(
+            description=_CREATE_TEMPLATE.substitute(
+                path=file.path, goal=run.plan.goal, step_context=step.description
+            ),
+            expected_output=f"Complete, production-ready content for {file.path}",
+            agent=_build_code_writer(run.llm),
+        )
+        run.creations[key] = asyncio.ensure_future(_kickoff(_solo_crew(create_task)))
+    if content is None:
+        content = _strip_fences(_crew_text(await run.creations[key]))
+
+    run.stage_write(file.path, content, f"Create {file.path} - {step.title}")
+    return f"✓ Created {file.path}"
+
+
+async def _process_modify(
+    run: _PlanRun, step: PlanStep, file: PlanFile, content: str | None
+) -> str:
+    """Rewrite an existing file, generating its content unless it was batched."""
+    try:
+        if file.path in run.sources:
+            existing_content = run.sources[file.path]["text"]
+        elif content is None:
+            existing_content = await get_file(run.owner, run.repo, file.path, token=run.token)
+        else:
+            existing_content = None
+
+        if content is None:
+            content = _recall_modify(run, step, file.path)
+
+        if content is None:
+            # Use LLM to intelligently modify the existing file
+            modify_task = Task(
+                description=_MODIFY_TEMPLATE.substitute(
+                    path=file.path,
+                    goal=run.plan.goal,
+                    step_context=step.description,
+                    existing=existing_content,
+                ),
+                expected_output=f"Complete, modified content for {file.path}",
+                agent=_build_code_writer(run.llm),
+            )
+            content = _strip_fences(_crew_text(await _kickoff(_solo_crew(modify_task))))
+            _remember_modify(run, step, file.path, content)
+
+        # Nothing to commit when the model left the file as it was
+        if existing_content is not None and content.strip() == existing_content.strip():
+            return f"= {file.path} unchanged"
+
+        run.stage_write(file.path, content, f"Modify {file.path} - {step.title}")
+        return f"✓ Modified {file.path}"
+    except Exception as e:  # noqa: BLE001
+        logger.exception(
+            "Failed to modify file %s in step %s: %s",
+            file.path,
+            step.step_number,
+            e,
+        )
+        return f"✗ Failed to modify {file.path}: {str(e)}"
+
+
+async def _process_delete(run: _PlanRun, step: PlanStep, file: PlanFile) -> str:
+    """Delete a file from the repository.
+
+    A file that is already gone (e.g. deleted by an earlier step or run) is
+    reported and skipped instead of failing the step.
+    """
+    if file.path in run.existing:
+        if file.path in run.staged and run.staged[file.path] is None:
+            return f"↷ {file.path} already absent"
+        run.stage_delete(file.path, f"Delete {file.path} - {step.title}")
+        return f"✓ Deleted {file.path}"
+    if file.path in run.staged:
+        # Created earlier in this run, so it never reaches the branch
+        del run.staged[file.path]
+        run.sources.pop(file.path, None)
+        return f"✓ Deleted {file.path}"
+
+    # Not prefetched: stage it if the branch has it, so it still lands in
+    # the run's single commit
+    try:
+        tree = await get_repo_tree(run.owner, run.repo, token=run.token)
+    except Exception as e:  # noqa: BLE001
+        logger.exception(
+            "Failed to delete file %s in step %s: %s",
+            file.path,
+            step.step_number,
+            e,
+        )
+        return f"✗ Failed to delete {file.path}: {str(e)}"
+    if file.path not in tree.paths:
+        return f"↷ {file.path} already absent"
+    run.existing.add(file.path)
+    run.stage_delete(file.path, f"Delete {file.path} - {step.title}")
+    return f"✓ Deleted {file.path}"
+
+
+async def _process_file(
+    run: _PlanRun, step: PlanStep, file: PlanFile, content: str | None = None
+) -> str:
+    """Apply a single file action of a plan step and return its summary line.
+
+    ``content`` is the already generated content for a CREATE or MODIFY file;
+    when it is None the content is generated for this file alone.
+    """
+    if file.action == "DELETE":
+        # Deletes need no LLM, so they do not hold a generation slot
+        return await _process_delete(run, step, file)
+
+    if file.action == "READ":
+        # READ is a planning/analysis action only, no repo change
+        return f"ℹ️ READ-only: inspected {file.path}"
+
+    process = _process_create if file.action == "CREATE" else _process_modify
+    async with run.limiter:
+        try:
+            return await process(run, step, file, content)
+        except Exception as e:  # noqa: BLE001
+            logger.exception(
+                "Error processing file %s in step %s: %s",
+                file.path,
+                step.step_number,
+                e,
+            )
+            return f"✗ Error processing {file.path}: {str(e)}"
+
+
+def _step_dependencies(steps: List[PlanStep]) -> list[set[int]]:
+    """For each step, the indices of earlier steps that touch any of its files.
+
+    Steps with disjoint file sets have no ordering constraint between them.
+    """
+    file_sets = [{file.path for file in step.files} for step in steps]
+    return [
+        {j for j in range(i) if file_sets[i] & file_sets[j]}
+        for i in range(len(steps))
+    ]
+
+
+async def _commit_staged(run: _PlanRun) -> Dict[str, str]:
+    """Commit every staged change and return {path: error} for failed ones.
+
+    All changes go into a single commit through the Git Data API. If that
+    fails, each file is written with its own commit instead.
+    """
+    if not run.staged:
+        return {}
+
+    try:
+        async with run.write_lock:
+            await commit_changes(
+                run.owner, run.repo, run.staged, run.commit_message(), token=run.token
+            )
+        invalidate_repo_tree(run.owner, run.repo)
+        return {}
+    except Exception as e:  # noqa: BLE001
+        logger.warning("[GitPilot] Single-commit apply failed, writing files one by one: %s", e)
+
+    failures: Dict[str, str] = {}
+    async with run.write_lock:
+        for path, content in run.staged.items():
+            try:
+                if content is None:
+                    await delete_file(
+                        run.owner, run.repo, path, f"GitPilot: Delete {path}", token=run.token
+                    )
+                else:
                     await put_file(
-                        owner,
-                        repo,
-                        file.path,
+                        run.owner,
+                        run.repo,
+                        path,
                         content,
-                        f"GitPilot: Create {file.path} - {step.title}",
-                        token=token,
+                        f"GitPilot: Update {path}",
+                        token=run.token,
                     )
-                    step_summary += f"\n  ✓ Created {file.path}"
-
-                elif file.action == "MODIFY":
-                    # Use LLM to intelligently modify the existing file
-                    try:
-                        existing_content = await get_file(owner, repo, file.path, token=token)
-
-                        modify_task = Task(
-                            description=(
-                                f"Modify the existing file: {file.path}\n\n"
-                                f"Overall Goal: {plan.goal}\n"
-                                f"Step Context: {step.description}\n\n"
-                                f"Current File Content:\n"
-                                f"---\n{existing_content}\n---\n\n"
-                                "Requirements:\n"
-                                "- Make the changes described in the step context\n"
-                                "- Preserve the existing structure and format\n"
-                                "- For documentation: update or add relevant sections\n"
-                                "- For code: add/modify functions, imports, or logic as needed\n"
-                                "- Ensure the result is complete and functional\n"
-                                "- Do NOT just add comments - make real, substantive changes\n\n"
-                                "Return ONLY the complete modified file content, no explanations."
-                            ),
-                            expected_output=f"Complete, modified content for {file.path}",
-                            agent=code_writer,
-                        )
-
-                        def _modify():
-                            crew = Crew(
-                                agents=[code_writer],
-                                tasks=[modify_task],
-                                process=Process.sequential,
-                                verbose=False,
-                            )
-                            result = crew.kickoff()
-                            if hasattr(result, "raw"):
-                                return result.raw
-                            return str(result)
-
-                        # FIX: Propagate context to the modification thread
-                        ctx = contextvars.copy_context()
-                        modified_content = await asyncio.to_thread(ctx.run, _modify)
-
-                        # Clean up any markdown code blocks
-                        modified_content = modified_content.strip()
-                        if modified_content.startswith("```"):
-                            lines = modified_content.split("\n")
-                            if lines[-1].strip() == "```":
-                                modified_content = "\n".join(lines[1:-1])
-                            else:
-                                modified_content = "\n".join(lines[1:])
-
-                        await put_file(
-                            owner,
-                            repo,
-                            file.path,
-                            modified_content,
-                            f"GitPilot: Modify {file.path} - {step.title}",
-                            token=token,
-                        )
-                        step_summary += f"\n  ✓ Modified {file.path}"
-                    except Exception as e:  # noqa: BLE001
-                        logger.exception(
-                            "Failed to modify file %s in step %s: %s",
-                            file.path,
-                            step.step_number,
-                            e,
-                        )
-                        step_summary += f"\n  ✗ Failed to modify {file.path}: {str(e)}"
-
-                elif file.action == "DELETE":
-                    # Actually delete the file from the repository
-                    from .github_api import delete_file
-
-                    try:
-                        await delete_file(
-                            owner,
-                            repo,
-                            file.path,
-                            f"GitPilot: Delete {file.path} - {step.title}",
-                            token=token,
-                        )
-                        step_summary += f"\n  ✓ Deleted {file.path}"
-                    except Exception as e:  # noqa: BLE001
-                        logger.exception(
-                            "Failed to delete file %s in step %s: %s",
-                            file.path,
-                            step.step_number,
-                            e,
-                        )
-                        step_summary += f"\n  ✗ Failed to delete {file.path}: {str(e)}"
-
-                elif file.action == "READ":
-                    # READ is a planning/analysis action only, no repo change
-                    step_summary += f"\n  ℹ️ READ-only: inspected {file.path}"
-
+            except HTTPException as e:
+                if content is None and e.status_code == 404:
+                    continue
+                failures[path] = str(e)
             except Exception as e:  # noqa: BLE001
-                logger.exception(
-                    "Error processing file %s in step %s: %s",
-                    file.path,
-                    step.step_number,
-                    e,
-                )
-                step_summary += f"\n  ✗ Error processing {file.path}: {str(e)}"
+                failures[path] = str(e)
+    invalidate_repo_tree(run.owner, run.repo)
+    return failures
+
+
+async def execute_plan(plan: PlanResult, repo_full_name: str, token: str | None = None) -> dict:
+    """Execute the approved plan by applying changes to the GitHub repository.
 
-        execution_steps.append({"step_number": step.step_number, "summary": step_summary})
+    Steps only wait for earlier steps that touch the same files, so steps with
+    disjoint file sets run concurrently. Contents for the CREATE and MODIFY
+    files of a step are generated in one batch each, then the files are
+    processed concurrently (bounded by MAX_CONCURRENT_FILES). Changes are
+    staged as they are produced and committed together once every step has
+    run. Returns an execution log with details about each step.
+    """
+    owner, repo = repo_full_name.split("/")
+    run = _PlanRun(plan=plan, owner=owner, repo=repo, token=token, llm=build_llm())
+
+    # Set repository context for tools (in case Code Writer needs them);
+    # they read staged changes first, so later steps see earlier steps' files
+    set_repo_context(owner, repo, token=token, staged=run.staged)
+
+    await _prefetch_sources(run)
+    run.existing = set(run.sources)
+
+    async def _run_step(step: PlanStep, deps: list[asyncio.Task]) -> list:
+        if deps:
+            await asyncio.gather(*deps)
+
+        generated = await _generate_step_contents(run, step)
+        return await asyncio.gather(
+            *(_process_file(run, step, file, generated.get(file.path)) for file in step.files),
+            return_exceptions=True,
+        )
+
+    # A failed file does not stop the run: _process_file reports it as a ✗
+    # line and the other files and steps carry on, so the log shows exactly
+    # what was and was not applied. Only an error outside file processing
+    # (e.g. in batch preparation) escapes a step; the group then cancels the
+    # other steps, including ones still queued for a generation slot.
+    pending: list[asyncio.Task] = []
+    try:
+        async with asyncio.TaskGroup() as group:
+            for step, deps in zip(plan.steps, _step_dependencies(plan.steps), strict=True):
+                waits_for = [pending[j] for j in sorted(deps)]
+                pending.append(group.create_task(_run_step(step, waits_for)))
+    except ExceptionGroup as eg:
+        # Callers handle single exceptions (HTTPException in particular), so
+        # the first is raised; the others are logged rather than lost
+        for error in eg.exceptions[1:]:
+            logger.error("[GitPilot] Plan step also failed", exc_info=error)
+        raise eg.exceptions[0] from eg
+
+    step_results = [task.result() for task in pending]
+    failures = await _commit_staged(run)
+
+    execution_steps = []
+    for step, results in zip(plan.steps, step_results, strict=True):
+        lines = [f"Step {step.step_number}: {step.title}"]
+        for file, result in zip(step.files, results, strict=True):
+            if isinstance(result, BaseException):
+                line = f"✗ Error processing {file.path}: {str(result)}"
+            elif file.path in failures and result.startswith("✓"):
+                line = f"✗ Failed to commit {file.path}: {failures[file.path]}"
+            else:
+                line = result
+            lines.append(f"  {line}")
+        execution_steps.append({"step_number": step.step_number, "summary": "\n".join(lines)})
+    execution_steps.sort(key=lambda entry: entry["step_number"])
 
     return {
         "status": "completed",
@@ -524,74 +1144,91 @@ async def execute_plan(plan: PlanResult, repo_full_name: str, token: str | None
     }
 
 
-async def get_flow_definition() -> dict:
+# The agent workflow is static, so the graph is built (and encoded) once at
+# import time. Callers share it; copy with dict() before modifying.
+_FLOW_GRAPH = {
+    "nodes": [
+        {
+            "id": "repo_explorer",
+            "label": "Repository Explorer",
+            "type": "tool",
+            "description": "Reports current repository state from the file tree",
+        },
+        {
+            "id": "planner",
+            "label": "Refactor Planner",
+            "type": "agent",
+            "description": "Creates safe, step-by-step refactor plans based on exploration",
+        },
+        {
+            "id": "code_writer",
+            "label": "Code Writer",
+            "type": "agent",
+            "description": "Implements approved changes to codebase",
+        },
+        {
+            "id": "reviewer",
+            "label": "Code Reviewer",
+            "type": "agent",
+            "description": "Reviews changes for quality and safety",
+        },
+        {
+            "id": "github_tools",
+            "label": "GitHub API",
+            "type": "tool",
+            "description": "Read/write/delete files, create commits & PRs",
+        },
+    ],
+    "edges": [
+        {
+            "id": "e1",
+            "source": "repo_explorer",
+            "target": "planner",
+            "label": "Complete repository state & file listing",
+        },
+        {
+            "id": "e2",
+            "source": "planner",
+            "target": "code_writer",
+            "label": "Approved plan with verified file actions",
+        },
+        {
+            "id": "e3",
+            "source": "code_writer",
+            "target": "reviewer",
+            "label": "Modified files",
+        },
+        {
+            "id": "e4",
+            "source": "reviewer",
+            "target": "github_tools",
+            "label": "Approved changes",
+        },
+        {
+            "id": "e5",
+            "source": "github_tools",
+            "target": "repo_explorer",
+            "label": "Updated repository state",
+        },
+    ],
+}
+_FLOW_DEFINITION: Mapping[str, Any] = MappingProxyType({
+    key: tuple(MappingProxyType(item) for item in items)
+    for key, items in _FLOW_GRAPH.items()
+})
+_FLOW_DEFINITION_JSON = json.dumps(_FLOW_GRAPH, separators=(",", ":")).encode("utf-8")
+del _FLOW_GRAPH
+
+
+async def get_flow_definition() -> Mapping[str, Any]:
     """Return the current CrewAI agent workflow as a visual graph.
 
     This represents the multi-agent system used for planning and execution.
+    The returned mapping is read-only.
     """
-    return {
-        "nodes": [
-            {
-                "id": "repo_explorer",
-                "label": "Repository Explorer",
-                "type": "agent",
-                "description": "Explores repository to gather current state",
-            },
-            {
-                "id": "planner",
-                "label": "Refactor Planner",
-                "type": "agent",
-                "description": "Creates safe, step-by-step refactor plans based on exploration",
-            },
-            {
-                "id": "code_writer",
-                "label": "Code Writer",
-                "type": "agent",
-                "description": "Implements approved changes to codebase",
-            },
-            {
-                "id": "reviewer",
-                "label": "Code Reviewer",
-                "type": "agent",
-                "description": "Reviews changes for quality and safety",
-            },
-            {
-                "id": "github_tools",
-                "label": "GitHub API",
-                "type": "tool",
-                "description": "Read/write/delete files, create commits & PRs",
-            },
-        ],
-        "edges": [
-            {
-                "id": "e1",
-                "source": "repo_explorer",
-                "target": "planner",
-                "label": "Complete repository state & file listing",
-            },
-            {
-                "id": "e2",
-                "source": "planner",
-                "target": "code_writer",
-                "label": "Approved plan with verified file actions",
-            },
-            {
-                "id": "e3",
-                "source": "code_writer",
-                "target": "reviewer",
-                "label": "Modified files",
-            },
-            {
-                "id": "e4",
-                "source": "reviewer",
-                "target": "github_tools",
-                "label": "Approved changes",
-            },
-            {
-                "id": "e5",
-                "source": "github_tools",
-                "target": "repo_explorer",
-                "label": "Updated repository state",
-            },
-        ],
-    }
+    return _FLOW_DEFINITION
+
+
+def get_flow_definition_json() -> bytes:
+    """Return the workflow graph already encoded as JSON."""
+    return _FLOW_DEFINITION_JSON
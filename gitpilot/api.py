@@ -1,10 +1,12 @@
 from __future__ import annotations
 
+import asyncio
+from contextlib import asynccontextmanager
 from pathlib import Path
 from typing import List, Optional
 
 from fastapi import FastAPI, Query, Path as FPath, Header
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, Response
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel, Field
 
@@ -12,15 +14,18 @@ from .version import __version__
 from .github_api import (
     list_user_repos,
     list_user_repos_paginated,  # NEW: Pagination support
+    list_all_user_repos,
     search_user_repos,  # NEW: Search across all repos
     get_repo_tree, 
     get_file, 
     put_file, 
-    execution_context
+    execution_context,
+    aclose_client,
 )
 from .github_app import check_repo_write_access
 from .settings import AppSettings, get_settings, set_provider, update_settings, LLMProvider
-from .agentic import generate_plan, execute_plan, PlanResult, get_flow_definition
+from .agentic import generate_plan, execute_plan, PlanResult, get_flow_definition_json
+from .agent_tools import invalidate_repo_tree, register_app_loop
 from .github_oauth import (
     generate_authorization_url,
     exchange_code_for_token,
@@ -34,10 +39,22 @@ import os
 from .model_catalog import list_models_for_provider
 
 
+@asynccontextmanager
+async def _lifespan(_app: FastAPI):
+    """Agent tools run in worker threads; let them reuse the server loop."""
+    register_app_loop(asyncio.get_running_loop())
+    try:
+        yield
+    finally:
+        register_app_loop(None)
+        await aclose_client()
+
+
 app = FastAPI(
     title="GitPilot API",
     version=__version__,
     description="Agentic AI assistant for GitHub repositories.",
+    lifespan=_lifespan,
 )
 
 
@@ -131,6 +148,8 @@ class ChatPlanRequest(BaseModel):
     repo_owner: str
     repo_name: str
     goal: str
+    # Plan from scratch even if an equivalent goal was planned on this tree
+    refresh: bool = False
 
 
 class ExecutePlanRequest(BaseModel):
@@ -139,6 +158,21 @@ class ExecutePlanRequest(BaseModel):
     plan: PlanResult
 
 
+class ExecutionStep(BaseModel):
+    step_number: int
+    summary: str
+
+
+class ExecutionLog(BaseModel):
+    steps: List[ExecutionStep] = Field(default_factory=list)
+
+
+class ExecutePlanResponse(BaseModel):
+    status: str
+    message: str
+    execution_log: ExecutionLog = Field(alias="executionLog")
+
+
 class AuthUrlResponse(BaseModel):
     authorization_url: str
     state: str
@@ -269,24 +303,8 @@ async def api_list_all_repos(
     token = get_github_token(authorization)
     
     try:
-        # Fetch all repositories (this will make multiple API calls)
-        all_repos = []
-        page = 1
-        max_pages = 15  # Safety limit: 1500 repos max (15 * 100)
-        
-        while page <= max_pages:
-            result = await list_user_repos_paginated(
-                page=page,
-                per_page=100,
-                token=token
-            )
-            
-            all_repos.extend(result["repositories"])
-            
-            if not result["has_more"]:
-                break
-            
-            page += 1
+        # Fetch all repositories (pages after the first are fetched concurrently)
+        all_repos = await list_all_user_repos(token=token)
         
         # Filter by query if provided
         if query:
@@ -331,7 +349,12 @@ async def api_repo_tree(
 ):
     token = get_github_token(authorization)
     tree = await get_repo_tree(owner, repo, token=token)
-    return FileTreeResponse(files=[FileEntry(**f) for f in tree])
+    return FileTreeResponse(
+        files=[
+            FileEntry(path=path, type=type_)
+            for path, type_ in zip(tree.paths, tree.types, strict=True)
+        ]
+    )
 
 
 @app.get("/api/repos/{owner}/{repo}/file", response_model=FileContent)
@@ -357,6 +380,7 @@ async def api_put_file(
     result = await put_file(
         owner, repo, payload.path, payload.content, payload.message, token=token
     )
+    invalidate_repo_tree(owner, repo)
     return CommitResponse(**result)
 
 
@@ -443,11 +467,11 @@ async def api_chat_plan(
     token = get_github_token(authorization)
     with execution_context(token):
         full_name = f"{req.repo_owner}/{req.repo_name}"
-        plan = await generate_plan(req.goal, full_name, token=token)
+        plan = await generate_plan(req.goal, full_name, token=token, refresh=req.refresh)
         return plan
 
 
-@app.post("/api/chat/execute")
+@app.post("/api/chat/execute", response_model=ExecutePlanResponse)
 async def api_chat_execute(
     req: ExecutePlanRequest,
     authorization: Optional[str] = Header(None)
@@ -462,8 +486,7 @@ async def api_chat_execute(
 @app.get("/api/flow/current")
 async def api_get_flow():
     """Return the current agent flow definition as a graph."""
-    flow = await get_flow_definition()
-    return flow
+    return Response(content=get_flow_definition_json(), media_type="application/json")
 
 
 # ============================================================================
@@ -0,0 +1,99 @@
+"""On-disk second tier for the plan cache, shared across processes.
+
+Plans are kept in a SQLite database under CACHE_DIR, so they survive worker
+restarts and are visible to every worker on the host. The in-memory cache in
+plan_cache stays in front of it. Like the tree cache, this is an
+optimization only: any database error is logged and treated as a miss.
+"""
+from __future__ import annotations
+
+import logging
+import sqlite3
+import threading
+import time
+from typing import List, Optional, Tuple
+
+from .settings import CACHE_DIR
+
+logger = logging.getLogger(__name__)
+
+DB_PATH = CACHE_DIR / "cache.db"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS plans (
+    repo TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    goal TEXT NOT NULL,
+    embedding BLOB,
+    plan_json TEXT NOT NULL,
+    ts REAL NOT NULL,
+    PRIMARY KEY (repo, fingerprint, goal)
+);
+"""
+
+_conn: Optional[sqlite3.Connection] = None
+_conn_failed = False
+_lock = threading.Lock()
+
+
+def _connection() -> Optional[sqlite3.Connection]:
+    """Open the database on first use; None if it cannot be opened."""
+    global _conn, _conn_failed
+
+    if _conn is None and not _conn_failed:
+        try:
+            DB_PATH.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(DB_PATH, check_same_thread=False, timeout=5)
+            # WAL lets readers in other workers proceed while one writes
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA mmap_size=268435456")
+            conn.executescript(_SCHEMA)
+            _conn = conn
+        except (OSError, sqlite3.Error) as e:
+            logger.warning("[GitPilot] On-disk cache disabled: %s", e)
+            _conn_failed = True
+    return _conn
+
+
+def get_plans(repo_full_name: str, fingerprint: str) -> List[Tuple[str, Optional[bytes], str]]:
+    """Return (normalized goal, embedding bytes, plan JSON) rows, oldest first."""
+    with _lock:
+        conn = _connection()
+        if conn is None:
+            return []
+        try:
+            return conn.execute(
+                "SELECT goal, embedding, plan_json FROM plans "
+                "WHERE repo = ? AND fingerprint = ? ORDER BY ts",
+                (repo_full_name, fingerprint),
+            ).fetchall()
+        except sqlite3.Error as e:
+            logger.warning("[GitPilot] On-disk cache read failed: %s", e)
+            return []
+
+
+def put_plan(
+    repo_full_name: str,
+    fingerprint: str,
+    goal: str,
+    embedding: Optional[bytes],
+    plan_json: str,
+) -> None:
+    """Store a plan for this tree, replacing those of older trees."""
+    with _lock:
+        conn = _connection()
+        if conn is None:
+            return
+        try:
+            with conn:
+                conn.execute(
+                    "DELETE FROM plans WHERE repo = ? AND fingerprint != ?",
+                    (repo_full_name, fingerprint),
+                )
+                conn.execute(
+                    "INSERT OR REPLACE INTO plans VALUES (?, ?, ?, ?, ?, ?)",
+                    (repo_full_name, fingerprint, goal, embedding, plan_json, time.time()),
+                )
+        except sqlite3.Error as e:
+            logger.warning("[GitPilot] On-disk cache write failed: %s", e)
@@ -1,15 +1,53 @@
 from __future__ import annotations
 
-import os
+import asyncio
 import contextvars
+import hashlib
+import importlib.util
+import json as jsonlib
+import os
+import random
+import re
+import threading
+import time
+import weakref
+from collections import OrderedDict
 from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
 from typing import Any, Dict, List, Optional
 
 import httpx
 from fastapi import HTTPException
 
+from .settings import CACHE_DIR
+
 GITHUB_API_BASE = "https://api.github.com"
 
+# One pooled client per event loop: keep-alive connections belong to the loop
+# that opened them, and agent tools may run on a loop of their own. HTTP/2 is
+# used when the optional "h2" package is installed.
+_HTTP2 = importlib.util.find_spec("h2") is not None
+_clients: weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient] = (
+    weakref.WeakKeyDictionary()
+)
+
+# orjson (from the optional "fast" extra) decodes large tree listings several
+# times faster than the stdlib; both accept bytes.
+try:
+    import orjson
+
+    _json_loads = orjson.loads
+    _json_dumps = orjson.dumps
+except ImportError:
+    _json_loads = jsonlib.loads
+
+    def _json_dumps(obj: Any) -> bytes:
+        return jsonlib.dumps(obj).encode("utf-8")
+
+# Trees are revalidated with If-None-Match; 304 responses are free of rate limit
+TREE_CACHE_DIR = CACHE_DIR / "tree"
+
 # Context variable to store the GitHub token for the current request/execution scope
 _request_token: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("request_token", default=None)
 
@@ -64,24 +102,108 @@ def _github_token(provided_token: Optional[str] = None) -> str:
     return token
 
 
-async def github_request(
+def get_client() -> httpx.AsyncClient:
+    """Return the shared GitHub API client for the running event loop."""
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            base_url=GITHUB_API_BASE,
+            http2=_HTTP2,
+            limits=httpx.Limits(max_connections=32, max_keepalive_connections=32),
+        )
+        _clients[loop] = client
+    return client
+
+
+async def aclose_client() -> None:
+    """Close the shared client of the running event loop, if any."""
+    client = _clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+
+# Rate-limited requests are retried this many times, as long as GitHub asks
+# for a wait of at most MAX_RATE_LIMIT_WAIT seconds
+RATE_LIMIT_RETRIES = 3
+MAX_RATE_LIMIT_WAIT = 60.0
+
+# (retries, max wait) for the current scope; see rate_limit_budget
+_rate_limit_budget: contextvars.ContextVar[tuple[int, float]] = contextvars.ContextVar(
+    "rate_limit_budget", default=(RATE_LIMIT_RETRIES, MAX_RATE_LIMIT_WAIT)
+)
+
+
+@contextmanager
+def rate_limit_budget(retries: int, max_wait: float):
+    """Limit how long rate-limited requests in this scope may wait and retry.
+
+    Callers that block on a request, like the agent tools, use a smaller
+    budget than the defaults so a rate limit fails fast instead of stalling.
+    """
+    budget_var = _rate_limit_budget.set((retries, max_wait))
+    try:
+        yield
+    finally:
+        _rate_limit_budget.reset(budget_var)
+
+
+def _rate_limit_delay(resp: httpx.Response, attempt: int) -> Optional[float]:
+    """Seconds to wait before retrying a rate-limited response, or None.
+
+    Honors Retry-After and X-RateLimit-Reset when GitHub sends them; secondary
+    limits without either back off exponentially with jitter. A plain 403
+    (missing permission) is not retried.
+    """
+    if resp.status_code not in (403, 429):
+        return None
+    if "Retry-After" in resp.headers:
+        try:
+            delay = float(resp.headers["Retry-After"])
+        except ValueError:
+            return None
+    elif resp.headers.get("X-RateLimit-Remaining") == "0":
+        try:
+            delay = float(resp.headers["X-RateLimit-Reset"]) - time.time()
+        except (KeyError, ValueError):
+            return None
+    elif resp.status_code == 429 or "secondary rate limit" in resp.text.lower():
+        delay = 5 * 2 ** attempt + random.random()  # noqa: S311 - jitter, not security
+    else:
+        return None
+    _, max_wait = _rate_limit_budget.get()
+    return max(delay, 0.0) if delay <= max_wait else None
+
+
+async def _github_send(
     path: str,
     *,
     method: str = "GET",
     json: Optional[Dict[str, Any]] = None,
     params: Optional[Dict[str, Any]] = None,
+    headers: Optional[Dict[str, str]] = None,
     token: Optional[str] = None,
-) -> Any:
+) -> httpx.Response:
+    """Send a GitHub API request and return the raw response, raising on errors."""
     github_token = _github_token(token)
 
-    headers = {
+    request_headers = {
         "Authorization": f"Bearer {github_token}",
         "Accept": "application/vnd.github+json",
         "User-Agent": "gitpilot",
     }
+    if headers:
+        request_headers.update(headers)
 
-    async with httpx.AsyncClient(base_url=GITHUB_API_BASE, headers=headers) as client:
-        resp = await client.request(method, path, json=json, params=params)
+    retries, _ = _rate_limit_budget.get()
+    for attempt in range(retries + 1):
+        resp = await get_client().request(
+            method, path, json=json, params=params, headers=request_headers
+        )
+        delay = _rate_limit_delay(resp, attempt)
+        if delay is None or attempt == retries:
+            break
+        await asyncio.sleep(delay)
 
     if resp.status_code >= 400:
         try:
@@ -95,6 +217,19 @@ async def github_request(
              
         raise HTTPException(status_code=resp.status_code, detail=msg)
 
+    return resp
+
+
+async def github_request(
+    path: str,
+    *,
+    method: str = "GET",
+    json: Optional[Dict[str, Any]] = None,
+    params: Optional[Dict[str, Any]] = None,
+    token: Optional[str] = None,
+) -> Any:
+    resp = await _github_send(path, method=method, json=json, params=params, token=token)
+
     if resp.status_code == 204:
         return None
     return resp.json()
@@ -143,6 +278,7 @@ async def list_user_repos_paginated(
             "page": int,
             "per_page": int,
             "has_more": bool,
+            "last_page": int,
         }
     """
     params = {
@@ -154,19 +290,7 @@ async def list_user_repos_paginated(
     }
     
     # Make request and get response with headers
-    github_token = _github_token(token)
-    headers = {
-        "Authorization": f"Bearer {github_token}",
-        "Accept": "application/vnd.github+json",
-        "User-Agent": "gitpilot",
-    }
-    
-    async with httpx.AsyncClient(base_url=GITHUB_API_BASE, headers=headers) as client:
-        resp = await client.get("/user/repos", params=params)
-    
-    if resp.status_code >= 400:
-        raise HTTPException(status_code=resp.status_code, detail=resp.text)
-    
+    resp = await _github_send("/user/repos", params=params, token=token)
     data = resp.json()
     
     repos = [
@@ -189,9 +313,46 @@ async def list_user_repos_paginated(
         "page": page,
         "per_page": per_page,
         "has_more": has_more,
+        "last_page": _last_page(link_header) or page,
     }
 
 
+_LINK_LAST_RE = re.compile(r'<[^>]*[?&]page=(\d+)[^>]*>;\s*rel="last"')
+
+
+def _last_page(link_header: str) -> Optional[int]:
+    """Page number of the rel="last" link in a GitHub Link header, if any."""
+    match = _LINK_LAST_RE.search(link_header)
+    return int(match.group(1)) if match else None
+
+
+# Safety limit for "fetch everything" listings: 1500 repos (15 * 100)
+MAX_REPO_PAGES = 15
+
+
+async def list_all_user_repos(token: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    Fetch every repository of the user, up to MAX_REPO_PAGES pages.
+
+    The first page tells us (via Link rel="last") how many pages there are;
+    the remaining pages are then requested concurrently.
+    """
+    first = await list_user_repos_paginated(page=1, per_page=100, token=token)
+    last_page = min(first["last_page"], MAX_REPO_PAGES)
+
+    rest = await asyncio.gather(
+        *(
+            list_user_repos_paginated(page=page, per_page=100, token=token)
+            for page in range(2, last_page + 1)
+        )
+    )
+
+    all_repos = list(first["repositories"])
+    for result in rest:
+        all_repos.extend(result["repositories"])
+    return all_repos
+
+
 async def search_user_repos(
     query: str,
     page: int = 1,
@@ -222,23 +383,7 @@ async def search_user_repos(
         }
     """
     # Fetch ALL repositories (across all pages)
-    all_repos = []
-    fetch_page = 1
-    max_pages = 15  # Safety limit: max 1500 repos
-    
-    while fetch_page <= max_pages:
-        result = await list_user_repos_paginated(
-            page=fetch_page,
-            per_page=100,
-            token=token
-        )
-        
-        all_repos.extend(result["repositories"])
-        
-        if not result["has_more"]:
-            break
-        
-        fetch_page += 1
+    all_repos = await list_all_user_repos(token=token)
     
     # Filter repositories by query
     query_lower = query.lower()
@@ -265,25 +410,221 @@ async def search_user_repos(
     }
 
 
-async def get_repo_tree(owner: str, repo: str, token: Optional[str] = None) -> list[dict[str, str]]:
-    data = await github_request(
+@dataclass(slots=True)
+class RepoTree:
+    """Blobs at HEAD as parallel arrays: entry i of each list describes one file.
+
+    ``sha`` is the root tree sha, which changes whenever any file does.
+    ``modes`` holds git file modes (``100644``, ``100755``, ``120000``...).
+    """
+    paths: list[str] = field(default_factory=list)
+    types: list[str] = field(default_factory=list)
+    shas: list[str] = field(default_factory=list)
+    sha: str = ""
+    modes: list[str] = field(default_factory=list)
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+
+def _tree_cache_file(owner: str, repo: str) -> Path:
+    """Path of a repository's cached tree.
+
+    owner and repo come from the request, so they are hashed rather than
+    used as path components; "..", separators and the like cannot escape
+    TREE_CACHE_DIR.
+    """
+    digest = hashlib.sha256(f"{owner}/{repo}".encode()).hexdigest()
+    return TREE_CACHE_DIR / f"{digest}.json"
+
+
+def _read_cached_tree(owner: str, repo: str) -> tuple[Optional[str], Optional[RepoTree]]:
+    """Return (etag, tree) from the on-disk tree cache, or (None, None)."""
+    cache_file = _tree_cache_file(owner, repo)
+    try:
+        cached = _json_loads(cache_file.read_bytes())
+        tree = RepoTree(
+            paths=cached["paths"],
+            types=cached["types"],
+            shas=cached["shas"],
+            sha=cached.get("sha", ""),
+            modes=cached["modes"],
+        )
+        return cached["etag"], tree
+    except (OSError, ValueError, KeyError, TypeError):
+        return None, None
+
+
+def _write_cached_tree(owner: str, repo: str, etag: str, tree: RepoTree) -> None:
+    cache_file = _tree_cache_file(owner, repo)
+    try:
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        cache_file.write_bytes(
+            _json_dumps({
+                "etag": etag,
+                "sha": tree.sha,
+                "paths": tree.paths,
+                "types": tree.types,
+                "shas": tree.shas,
+                "modes": tree.modes,
+            })
+        )
+    except OSError:
+        pass  # The cache is an optimization only
+
+
+async def get_repo_tree(owner: str, repo: str, token: Optional[str] = None) -> RepoTree:
+    """
+    Return all blobs at HEAD.
+
+    The last response is kept on disk with its ETag and revalidated with
+    If-None-Match, so an unchanged tree costs a bodiless 304.
+    """
+    etag, cached_tree = _read_cached_tree(owner, repo)
+    headers = {"If-None-Match": etag} if etag and cached_tree is not None else None
+
+    resp = await _github_send(
         f"/repos/{owner}/{repo}/git/trees/HEAD",
         params={"recursive": 1},
+        headers=headers,
         token=token,
     )
-    return [
-        {"path": item["path"], "type": item["type"]}
-        for item in data.get("tree", [])
-        if item.get("type") == "blob"
-    ]
+    if resp.status_code == 304 and cached_tree is not None:
+        return cached_tree
+
+    data = _json_loads(resp.content)
+    tree = RepoTree(sha=data.get("sha", ""))
+    for item in data.get("tree", []):
+        if item.get("type") == "blob":
+            tree.paths.append(item["path"])
+            tree.types.append(item["type"])
+            tree.shas.append(item.get("sha", ""))
+            tree.modes.append(item.get("mode", DEFAULT_FILE_MODE))
+    new_etag = resp.headers.get("ETag")
+    if new_etag:
+        _write_cached_tree(owner, repo, new_etag, tree)
+    return tree
+
+
+# Recently read files with their ETags, revalidated with If-None-Match
+_BLOB_ETAG_CACHE_SIZE = 1024
+_blob_etags: OrderedDict[tuple[str, str, str], tuple[str, dict[str, str]]] = OrderedDict()
+# Agent tools read files from their own loop thread as well as the server's
+_blob_etags_lock = threading.Lock()
+
+
+def _remember_blob(key: tuple[str, str, str], etag: str, blob: dict[str, str]) -> None:
+    """Store ``blob`` as the most recently used entry, evicting the oldest ones."""
+    with _blob_etags_lock:
+        # Re-inserting also covers an entry evicted while the request was in flight
+        _blob_etags[key] = (etag, blob)
+        _blob_etags.move_to_end(key)
+        while len(_blob_etags) > _BLOB_ETAG_CACHE_SIZE:
+            _blob_etags.popitem(last=False)
+
+
+async def get_file_blob(
+    owner: str, repo: str, path: str, token: Optional[str] = None
+) -> dict[str, str]:
+    """Return {"sha": blob sha, "text": decoded content} for a file at HEAD.
+
+    A file read before is revalidated with If-None-Match; when it has not
+    changed GitHub answers 304 without a body and the cached copy is reused.
+    """
+    from base64 import b64decode
 
+    key = (owner, repo, path)
+    with _blob_etags_lock:
+        etag, cached = _blob_etags.get(key, (None, None))
+    headers = {"If-None-Match": etag} if etag else None
 
-async def get_file(owner: str, repo: str, path: str, token: Optional[str] = None) -> str:
-    from base64 import b64decode
+    resp = await _github_send(
+        f"/repos/{owner}/{repo}/contents/{path}", headers=headers, token=token
+    )
+    if resp.status_code == 304 and cached is not None:
+        _remember_blob(key, etag, cached)
+        return dict(cached)
 
-    data = await github_request(f"/repos/{owner}/{repo}/contents/{path}", token=token)
+    data = resp.json()
     content_b64 = data.get("content") or ""
-    return b64decode(content_b64.encode("utf-8")).decode("utf-8", errors="replace")
+    blob = {
+        "sha": data.get("sha") or "",
+        "text": b64decode(content_b64.encode("utf-8")).decode("utf-8", errors="replace"),
+    }
+    new_etag = resp.headers.get("ETag")
+    if new_etag:
+        _remember_blob(key, new_etag, blob)
+    return dict(blob)
+
+
+async def get_file(owner: str, repo: str, path: str, token: Optional[str] = None) -> str:
+    return (await get_file_blob(owner, repo, path, token=token))["text"]
+
+
+# GitHub's GraphQL API accepts many aliased fields per query; keep batches modest
+GRAPHQL_FILES_PER_QUERY = 50
+
+
+async def get_files_batch(
+    owner: str,
+    repo: str,
+    paths: List[str],
+    token: Optional[str] = None,
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Fetch several files at HEAD with one GraphQL query per batch of paths.
+
+    Returns:
+        {path: {"sha": str, "text": str}} for every text file that exists.
+        Missing, binary and truncated blobs are left out so callers can fall
+        back to get_file() for them.
+    """
+    files: Dict[str, Dict[str, Any]] = {}
+
+    for start in range(0, len(paths), GRAPHQL_FILES_PER_QUERY):
+        batch = paths[start:start + GRAPHQL_FILES_PER_QUERY]
+        variables: Dict[str, Any] = {"owner": owner, "name": repo}
+        declarations = ["$owner: String!", "$name: String!"]
+        fields = []
+        for i, path in enumerate(batch):
+            variables[f"e{i}"] = f"HEAD:{path}"
+            declarations.append(f"$e{i}: String!")
+            fields.append(
+                f"f{i}: object(expression: $e{i}) "
+                "{ ... on Blob { oid text isBinary isTruncated } }"
+            )
+
+        query = (
+            f"query({', '.join(declarations)}) {{ "
+            f"repository(owner: $owner, name: $name) {{ {' '.join(fields)} }} }}"
+        )
+        data = await github_request(
+            "/graphql",
+            method="POST",
+            json={"query": query, "variables": variables},
+            token=token,
+        )
+
+        repository = (data.get("data") or {}).get("repository")
+        if repository is None:
+            errors = data.get("errors") or [{}]
+            raise HTTPException(
+                status_code=502,
+                detail=errors[0].get("message") or f"Could not read files from {owner}/{repo}",
+            )
+
+        for i, path in enumerate(batch):
+            blob = repository.get(f"f{i}")
+            if (
+                not blob
+                or blob.get("isBinary")
+                or blob.get("isTruncated")
+                or blob.get("text") is None
+            ):
+                continue
+            files[path] = {"sha": blob.get("oid", ""), "text": blob["text"]}
+
+    return files
 
 
 async def put_file(
@@ -293,21 +634,25 @@ async def put_file(
     content: str,
     message: str,
     token: Optional[str] = None,
+    sha: Optional[str] = None,
 ) -> dict[str, Any]:
     """
     Create or update a file in the repository.
     
     Uses the user's OAuth token. If the user doesn't have write access,
     they need to install the GitPilot GitHub App on the repository.
+
+    Pass the current blob ``sha`` when it is already known to skip the
+    lookup request. The returned dict includes the new blob ``sha``.
     """
     from base64 import b64encode
 
-    sha: str | None = None
-    try:
-        existing = await github_request(f"/repos/{owner}/{repo}/contents/{path}", token=token)
-        sha = existing.get("sha")
-    except HTTPException:
-        sha = None
+    if sha is None:
+        try:
+            existing = await github_request(f"/repos/{owner}/{repo}/contents/{path}", token=token)
+            sha = existing.get("sha")
+        except HTTPException:
+            sha = None
 
     body: dict[str, Any] = {
         "message": message,
@@ -325,6 +670,7 @@ async def put_file(
     commit = result.get("commit", {})
     return {
         "path": path,
+        "sha": (result.get("content") or {}).get("sha", ""),
         "commit_sha": commit.get("sha", ""),
         "commit_url": commit.get("html_url"),
     }
@@ -336,15 +682,20 @@ async def delete_file(
     path: str,
     message: str,
     token: Optional[str] = None,
+    sha: Optional[str] = None,
 ) -> dict[str, Any]:
     """
     Delete a file from the repository.
     
     Uses the user's OAuth token. If the user doesn't have write access,
     they need to install the GitPilot GitHub App on the repository.
+
+    Pass the current blob ``sha`` when it is already known to skip the
+    lookup request.
     """
-    existing = await github_request(f"/repos/{owner}/{repo}/contents/{path}", token=token)
-    sha = existing.get("sha")
+    if sha is None:
+        existing = await github_request(f"/repos/{owner}/{repo}/contents/{path}", token=token)
+        sha = existing.get("sha")
 
     if not sha:
         raise HTTPException(
@@ -369,4 +720,178 @@ async def delete_file(
         "path": path,
         "commit_sha": commit.get("sha", ""),
         "commit_url": commit.get("html_url"),
-    }
\ No newline at end of file
+    }
+
+async def create_tree(
+    owner: str,
+    repo: str,
+    base_tree: str,
+    entries: List[Dict[str, Any]],
+    token: Optional[str] = None,
+) -> str:
+    """Create a tree on top of ``base_tree`` and return its sha.
+
+    Entries with ``content`` write that text to ``path``; entries with a
+    null ``sha`` remove ``path``.
+    """
+    result = await github_request(
+        f"/repos/{owner}/{repo}/git/trees",
+        method="POST",
+        json={"base_tree": base_tree, "tree": entries},
+        token=token,
+    )
+    return result["sha"]
+
+
+async def create_commit(
+    owner: str,
+    repo: str,
+    message: str,
+    tree: str,
+    parents: List[str],
+    token: Optional[str] = None,
+) -> dict[str, Any]:
+    """Create a commit object (without moving any branch) and return it."""
+    return await github_request(
+        f"/repos/{owner}/{repo}/git/commits",
+        method="POST",
+        json={"message": message, "tree": tree, "parents": parents},
+        token=token,
+    )
+
+
+async def create_blob(owner: str, repo: str, content: str, token: Optional[str] = None) -> str:
+    """Upload ``content`` as a blob and return its sha."""
+    from base64 import b64encode
+
+    result = await github_request(
+        f"/repos/{owner}/{repo}/git/blobs",
+        method="POST",
+        json={"content": b64encode(content.encode("utf-8")).decode("ascii"), "encoding": "base64"},
+        token=token,
+    )
+    return result["sha"]
+
+
+# Attempts at moving the branch when it advances between reading its head
+# and updating it
+COMMIT_CHANGES_ATTEMPTS = 3
+
+# Mode of regular, non-executable files; new paths are created with it
+DEFAULT_FILE_MODE = "100644"
+
+# Contents up to this size (in characters) are sent inline in the tree
+# request; larger ones are uploaded as blobs first, concurrently, so the
+# tree request stays small and a retried commit does not resend them.
+INLINE_CONTENT_LIMIT = 64 * 1024
+
+
+async def commit_changes(
+    owner: str,
+    repo: str,
+    changes: Dict[str, Optional[str]],
+    message: str,
+    token: Optional[str] = None,
+) -> dict[str, Any]:
+    """
+    Apply several file changes to the default branch as a single commit.
+
+    ``changes`` maps each path to its new content, or to None to delete it.
+    Unlike put_file/delete_file, which commit once per file, this costs a
+    fixed number of requests however many files change (plus one blob upload
+    per file above INLINE_CONTENT_LIMIT). If the branch moves while the
+    commit is being built, it is rebuilt on the new head.
+
+    Existing files keep their mode (executable scripts stay executable,
+    symlinks stay symlinks); new files get DEFAULT_FILE_MODE.
+    """
+    large = [
+        path for path, content in changes.items()
+        if content is not None and len(content) > INLINE_CONTENT_LIMIT
+    ]
+    blobs, tree = await asyncio.gather(
+        asyncio.gather(*(create_blob(owner, repo, changes[path], token=token) for path in large)),
+        get_repo_tree(owner, repo, token=token),
+    )
+    blob_shas = dict(zip(large, blobs, strict=True))
+    modes = dict(zip(tree.paths, tree.modes, strict=True))
+
+    entries: List[Dict[str, Any]] = []
+    for path, content in changes.items():
+        mode = modes.get(path, DEFAULT_FILE_MODE)
+        entry: Dict[str, Any] = {"path": path, "mode": mode, "type": "blob"}
+        if path in blob_shas:
+            entry["sha"] = blob_shas[path]
+        elif content is not None:
+            entry["content"] = content
+        else:
+            entry["sha"] = None
+        entries.append(entry)
+
+    repo_info = await github_request(f"/repos/{owner}/{repo}", token=token)
+    branch = repo_info["default_branch"]
+
+    async with _repo_write_lock(owner, repo):
+        return await _commit_tree(owner, repo, branch, entries, message, token)
+
+
+# Commits to one repository from this process are applied one at a time, so
+# concurrent plans queue up instead of racing and rebuilding on each other.
+# Like the clients, locks belong to one event loop; a repository's lock only
+# lives while a commit holds or waits for it.
+_repo_write_locks: (
+    weakref.WeakKeyDictionary[
+        asyncio.AbstractEventLoop, weakref.WeakValueDictionary[tuple[str, str], asyncio.Lock]
+    ]
+) = weakref.WeakKeyDictionary()
+
+
+def _repo_write_lock(owner: str, repo: str) -> asyncio.Lock:
+    """Return the lock serializing commits to a repository on the running loop."""
+    locks = _repo_write_locks.setdefault(asyncio.get_running_loop(), weakref.WeakValueDictionary())
+    lock = locks.get((owner, repo))
+    if lock is None:
+        lock = locks[(owner, repo)] = asyncio.Lock()
+    return lock
+
+
+async def _commit_tree(
+    owner: str,
+    repo: str,
+    branch: str,
+    entries: List[Dict[str, Any]],
+    message: str,
+    token: Optional[str],
+) -> dict[str, Any]:
+    """Commit ``entries`` on top of ``branch`` and move the branch to it."""
+    attempt = 1
+    while True:
+        head = await github_request(
+            f"/repos/{owner}/{repo}/branches/{branch}", token=token
+        )
+        head_sha = head["commit"]["sha"]
+        base_tree = head["commit"]["commit"]["tree"]["sha"]
+
+        tree_sha = await create_tree(owner, repo, base_tree, entries, token=token)
+        commit = await create_commit(
+            owner, repo, message, tree_sha, [head_sha], token=token
+        )
+        try:
+            await github_request(
+                f"/repos/{owner}/{repo}/git/refs/heads/{branch}",
+                method="PATCH",
+                json={"sha": commit["sha"], "force": False},
+                token=token,
+            )
+        except HTTPException as e:
+            # 422: not a fast-forward, someone else pushed in the meantime
+            if e.status_code != 422 or attempt >= COMMIT_CHANGES_ATTEMPTS:
+                raise
+            attempt += 1
+            continue
+
+        return {
+            "commit_sha": commit["sha"],
+            "commit_url": commit.get("html_url"),
+            "tree_sha": tree_sha,
+        }
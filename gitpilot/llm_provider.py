@@ -1,15 +1,38 @@
 from __future__ import annotations
 
 import os
+import threading
 
 from crewai import LLM
 
-from .settings import LLMProvider, get_settings
+from .settings import AppSettings, LLMProvider, get_settings
+
+# The last LLM built, keyed by a snapshot of the settings it was built from.
+# Settings are mutated in place by the admin endpoints, so the snapshot (not
+# the object identity) decides whether the cached client is still valid.
+_cached_llm: tuple[str, LLM] | None = None
+_cached_llm_lock = threading.Lock()
 
 
 def build_llm() -> LLM:
-    """Return an initialized CrewAI LLM using the active provider."""
+    """Return an initialized CrewAI LLM using the active provider.
+
+    The instance is reused across calls until the active provider's settings
+    change, so its HTTP connection pool stays warm.
+    """
+    global _cached_llm
+
     settings = get_settings()
+    key = settings.model_dump_json(include={"provider", settings.provider.value})
+
+    with _cached_llm_lock:
+        if _cached_llm is None or _cached_llm[0] != key:
+            _cached_llm = (key, _create_llm(settings))
+        return _cached_llm[1]
+
+
+def _create_llm(settings: AppSettings) -> LLM:
+    """Build a CrewAI LLM for the active provider in ``settings``."""
     provider = settings.provider
 
     if provider == LLMProvider.openai:
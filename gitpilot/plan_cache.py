@@ -0,0 +1,171 @@
+"""Reuse plans for goals that were already planned on the same repository state.
+
+Entries are keyed by repository and by its root tree sha, which changes with
+any file's path or content, so a plan is only ever reused against the exact
+tree it was made for. Within one tree, goals are matched by their normalized
+text and, when sentence-transformers is installed, by embedding similarity.
+A similar goal is only trusted for plans that delete nothing and when both
+goals name the same files (see _may_reuse_similar).
+
+Entries are also written to cache_db, so a restarted (or another) worker
+starts with the plans already made on this host.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Any, List, Optional, Tuple
+
+from pydantic import BaseModel, ValidationError
+
+from . import cache_db
+
+logger = logging.getLogger(__name__)
+
+# Cosine similarity above which two goals count as the same request
+SIMILARITY_THRESHOLD = 0.92
+
+# Bounds on memory: repository states kept, and plans kept per state
+MAX_STATES = 64
+MAX_PLANS_PER_STATE = 16
+
+EMBED_MODEL = os.getenv("GITPILOT_EMBED_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+
+try:
+    import numpy as np
+    from sentence_transformers import SentenceTransformer
+except ImportError:  # optional: fall back to exact (normalized) goal matching
+    np = None
+    SentenceTransformer = None
+
+_model: Any = None
+_model_failed = False
+_model_lock = threading.Lock()
+
+# (repo_full_name, tree sha) -> [(normalized goal, embedding or None, plan)]
+_entries: OrderedDict[Tuple[str, str], List[Tuple[str, Any, Any]]] = OrderedDict()
+_entries_lock = threading.Lock()
+
+
+def _normalize(goal: str) -> str:
+    return " ".join(goal.lower().split())
+
+
+_PATH_TOKEN_RE = re.compile(r"[\w.-]*[./][\w./-]*\w")
+
+
+def _may_reuse_similar(goal: str, cached_goal: str, plan: Any) -> bool:
+    """Whether ``plan``, made for ``cached_goal``, may answer a similar ``goal``.
+
+    Embeddings barely separate goals that differ in one token, and "delete
+    everything except README.md" vs "... except LICENSE" ask for opposite
+    deletions; so plans that delete files need the exact goal. Other plans
+    are reused only if both goals name the same files.
+    """
+    if any(file.action == "DELETE" for step in plan.steps for file in step.files):
+        return False
+    return set(_PATH_TOKEN_RE.findall(goal)) == set(_PATH_TOKEN_RE.findall(cached_goal))
+
+
+def _embed(text: str) -> Any:
+    """Unit-length embedding of ``text``, or None without a usable model."""
+    global _model, _model_failed
+
+    if SentenceTransformer is None or _model_failed:
+        return None
+    with _model_lock:
+        if _model is None:
+            try:
+                _model = SentenceTransformer(EMBED_MODEL)
+            except Exception as e:  # noqa: BLE001
+                logger.warning("[GitPilot] Plan cache embeddings disabled: %s", e)
+                _model_failed = True
+                return None
+    return _model.encode(text, normalize_embeddings=True)
+
+
+def _load_persisted(
+    repo_full_name: str, tree_sha: str, model: type[BaseModel]
+) -> List[Tuple[str, Any, Any]]:
+    """Read this tree's plans from cache_db into memory and return them."""
+    entries = []
+    for goal, blob, plan_json in cache_db.get_plans(repo_full_name, tree_sha):
+        try:
+            plan = model.model_validate_json(plan_json)
+        except ValidationError:
+            continue  # written by an older, incompatible version
+        embedding = np.frombuffer(blob, dtype="float32") if blob and np else None
+        entries.append((goal, embedding, plan))
+    entries = entries[-MAX_PLANS_PER_STATE:]
+
+    if entries:
+        with _entries_lock:
+            _entries.setdefault((repo_full_name, tree_sha), entries)
+            while len(_entries) > MAX_STATES:
+                _entries.popitem(last=False)
+    return entries
+
+
+async def lookup(
+    repo_full_name: str, tree_sha: str, goal: str, model: type[BaseModel]
+) -> Optional[Any]:
+    """Return a cached plan for an equivalent goal on the same tree, if any.
+
+    Plans only found on disk are decoded as ``model``.
+    """
+    with _entries_lock:
+        candidates = list(_entries.get((repo_full_name, tree_sha), ()))
+    if not candidates:
+        candidates = await asyncio.to_thread(_load_persisted, repo_full_name, tree_sha, model)
+    if not candidates:
+        return None
+
+    normalized = _normalize(goal)
+    for cached_goal, _, plan in candidates:
+        if cached_goal == normalized:
+            return plan
+
+    # Encoding is CPU-bound; keep it off the event loop
+    embedding = await asyncio.to_thread(_embed, normalized)
+    if embedding is None:
+        return None
+
+    best_plan, best_score = None, SIMILARITY_THRESHOLD
+    for cached_goal, cached_embedding, plan in candidates:
+        if cached_embedding is None or not _may_reuse_similar(normalized, cached_goal, plan):
+            continue
+        score = float(embedding @ cached_embedding)
+        if score >= best_score:
+            best_plan, best_score = plan, score
+    if best_plan is None:
+        return None
+    # A similar goal's plan now answers this one, so it carries the user's wording
+    return best_plan.model_copy(update={"goal": goal})
+
+
+async def store(repo_full_name: str, tree_sha: str, goal: str, plan: BaseModel) -> None:
+    """Remember ``plan`` as the answer to ``goal`` on this tree."""
+    normalized = _normalize(goal)
+    embedding = await asyncio.to_thread(_embed, normalized)
+
+    key = (repo_full_name, tree_sha)
+    with _entries_lock:
+        plans = _entries.pop(key, [])
+        plans = [entry for entry in plans if entry[0] != normalized]
+        plans.append((normalized, embedding, plan))
+        _entries[key] = plans[-MAX_PLANS_PER_STATE:]
+
+        # Once a repository moves on, plans for its older trees are rarely reused
+        for stale in [k for k in _entries if k[0] == repo_full_name and k != key]:
+            del _entries[stale]
+        while len(_entries) > MAX_STATES:
+            _entries.popitem(last=False)
+
+    blob = None if embedding is None else embedding.astype("float32").tobytes()
+    await asyncio.to_thread(
+        cache_db.put_plan, repo_full_name, tree_sha, normalized, blob, plan.model_dump_json()
+    )
@@ -13,6 +13,7 @@ load_dotenv()
 
 CONFIG_DIR = Path.home() / ".gitpilot"
 CONFIG_FILE = CONFIG_DIR / "settings.json"
+CACHE_DIR = Path.home() / ".cache" / "gitpilot"
 
 
 class LLMProvider(str, enum.Enum):
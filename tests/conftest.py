@@ -0,0 +1,47 @@
+"""Shared fixtures: a scripted stand-in for the GitHub REST API."""
+from __future__ import annotations
+
+from typing import Any, Dict, List, Optional, Tuple
+
+import pytest
+
+from gitpilot import github_api
+
+
+class FakeGitHub:
+    """Answers github_request calls from a table of (method, path) handlers.
+
+    A handler is either a value to return or a callable taking the JSON body;
+    callables may raise (e.g. HTTPException) to simulate API errors. Every
+    call is recorded in ``calls`` as (method, path, json).
+    """
+
+    def __init__(self) -> None:
+        self.routes: Dict[Tuple[str, str], Any] = {}
+        self.calls: List[Tuple[str, str, Optional[Dict[str, Any]]]] = []
+
+    def route(self, method: str, path: str, handler: Any) -> None:
+        self.routes[(method, path)] = handler
+
+    def requests(self, method: str, path: str) -> List[Optional[Dict[str, Any]]]:
+        return [body for m, p, body in self.calls if (m, p) == (method, path)]
+
+    async def request(
+        self,
+        path: str,
+        *,
+        method: str = "GET",
+        json: Optional[Dict[str, Any]] = None,
+        params: Optional[Dict[str, Any]] = None,
+        token: Optional[str] = None,
+    ) -> Any:
+        self.calls.append((method, path, json))
+        handler = self.routes[(method, path)]
+        return handler(json) if callable(handler) else handler
+
+
+@pytest.fixture
+def github(monkeypatch: pytest.MonkeyPatch) -> FakeGitHub:
+    fake = FakeGitHub()
+    monkeypatch.setattr(github_api, "github_request", fake.request)
+    return fake
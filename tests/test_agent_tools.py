@@ -0,0 +1,118 @@
+"""Tests for the repository tools the agents call."""
+from __future__ import annotations
+
+import asyncio
+import threading
+
+import pytest
+
+pytest.importorskip("crewai")
+
+from gitpilot import agent_tools, github_api  # noqa: E402
+from gitpilot.github_api import RepoTree  # noqa: E402
+
+
+def _call(tool, *args):
+    # CrewAI wraps decorated functions in Tool objects; the function is .func
+    return getattr(tool, "func", tool)(*args)
+
+
+@pytest.fixture
+def repo_context(monkeypatch):
+    tree = RepoTree(
+        paths=["README.md", "src/app.py"],
+        types=["blob", "blob"],
+        shas=["s1", "s2"],
+        sha="root",
+        modes=["100644", "100644"],
+    )
+
+    async def fake_tree(owner, repo, token=None):
+        return tree
+
+    async def fake_blob(owner, repo, path, token=None):
+        return {"sha": f"sha-{path}", "text": f"committed {path}"}
+
+    monkeypatch.setattr(agent_tools, "get_repo_tree", fake_tree)
+    monkeypatch.setattr(agent_tools, "get_file_blob", fake_blob)
+    staged = {}
+    agent_tools.set_repo_context("o", "r", staged=staged)
+    yield staged
+    agent_tools.set_repo_context("", "")
+
+
+def test_read_file_sees_staged_changes(repo_context):
+    repo_context["docs/new.md"] = "fresh"
+    repo_context["README.md"] = None
+
+    assert "fresh" in _call(agent_tools.read_file, "docs/new.md")
+    assert "deleted" in _call(agent_tools.read_file, "README.md")
+    assert "committed src/app.py" in _call(agent_tools.read_file, "src/app.py")
+
+
+def test_read_files_sees_staged_changes(repo_context):
+    repo_context["src/app.py"] = "rewritten"
+    repo_context["README.md"] = None
+
+    output = _call(agent_tools.read_files, ["src/app.py", "README.md"])
+    assert "rewritten" in output
+    assert "Could not read README.md" in output
+
+
+def test_search_files_sees_staged_changes(repo_context):
+    repo_context["src/new_app.py"] = "x"
+    repo_context["src/app.py"] = None
+
+    output = _call(agent_tools.search_files, "app")
+    assert "src/new_app.py" in output
+    assert "- src/app.py" not in output
+
+
+def test_listing_tools_see_staged_changes(repo_context):
+    # Build the listings first so stale cached renders would show up below
+    assert "src/app.py" in _call(agent_tools.list_repository_files)
+    _call(agent_tools.get_directory_structure)
+
+    repo_context["docs/new.md"] = "fresh"
+    repo_context["src/app.py"] = None
+
+    listing = _call(agent_tools.list_repository_files)
+    assert "docs/new.md" in listing
+    assert "src/app.py" not in listing
+    structure = _call(agent_tools.get_directory_structure)
+    assert "new.md" in structure
+    assert "app.py" not in structure
+    assert "new.md" in _call(agent_tools.list_directory_files, "docs")
+    assert "app.py" not in _call(agent_tools.list_directory_files, "src")
+    summary = _call(agent_tools.get_repository_summary)
+    assert "2 files found" in summary
+
+
+def test_run_async_cancels_the_coroutine_on_timeout(monkeypatch):
+    monkeypatch.setattr(agent_tools, "_TOOL_TIMEOUT", 0.05)
+    cancelled = threading.Event()
+
+    async def slow():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    with pytest.raises(TimeoutError):
+        agent_tools._run_async(slow())
+    assert cancelled.wait(1)
+
+
+def test_tools_use_a_short_rate_limit_budget():
+    async def budget():
+        return github_api._rate_limit_budget.get()
+
+    retries, max_wait = agent_tools._run_async(budget())
+
+    assert retries < github_api.RATE_LIMIT_RETRIES
+    assert max_wait < github_api.MAX_RATE_LIMIT_WAIT
+    assert retries * max_wait < agent_tools._TOOL_TIMEOUT
+    # The budget only applies to the tool's own coroutine
+    defaults = (github_api.RATE_LIMIT_RETRIES, github_api.MAX_RATE_LIMIT_WAIT)
+    assert github_api._rate_limit_budget.get() == defaults
@@ -0,0 +1,348 @@
+"""Tests for plan execution helpers, with GitHub and the LLM mocked out."""
+from __future__ import annotations
+
+import asyncio
+from collections import Counter
+
+import pytest
+
+pytest.importorskip("crewai")
+
+from fastapi import HTTPException  # noqa: E402
+
+from gitpilot import agentic  # noqa: E402
+from gitpilot.agentic import PlanFile, PlanResult, PlanStep  # noqa: E402
+from gitpilot.github_api import RepoTree  # noqa: E402
+
+
+def _plan(*steps: PlanStep, goal: str = "goal") -> PlanResult:
+    return PlanResult(goal=goal, summary="summary", steps=list(steps))
+
+
+def _step(number: int, *files: tuple, description: str = "do it") -> PlanStep:
+    return PlanStep(
+        step_number=number,
+        title=f"step {number}",
+        description=description,
+        files=[PlanFile(path=path, action=action) for path, action in files],
+    )
+
+
+def _run(plan: PlanResult) -> agentic._PlanRun:
+    return agentic._PlanRun(plan=plan, owner="o", repo="r", token=None, llm=None)
+
+
+def test_commit_staged_uses_one_commit(monkeypatch):
+    commits = []
+
+    async def fake_commit(owner, repo, changes, message, token=None):
+        commits.append((dict(changes), message))
+
+    monkeypatch.setattr(agentic, "commit_changes", fake_commit)
+    run = _run(_plan(_step(1, ("a.py", "CREATE")), goal="add a"))
+    run.stage_write("a.py", "x = 1\n", "Create a.py - step 1")
+
+    assert asyncio.run(agentic._commit_staged(run)) == {}
+    assert commits == [({"a.py": "x = 1\n"}, "GitPilot: add a\n\n- Create a.py - step 1")]
+
+
+def test_commit_staged_falls_back_to_per_file_writes(monkeypatch):
+    async def failing_commit(*args, **kwargs):
+        raise HTTPException(status_code=409, detail="conflict")
+
+    writes, deletes = [], []
+
+    async def fake_put(owner, repo, path, content, message, token=None, sha=None):
+        if path == "bad.py":
+            raise HTTPException(status_code=422, detail="rejected")
+        writes.append((path, content))
+
+    async def fake_delete(owner, repo, path, message, token=None, sha=None):
+        deletes.append(path)
+        if path == "gone.txt":
+            raise HTTPException(status_code=404, detail="not found")
+
+    monkeypatch.setattr(agentic, "commit_changes", failing_commit)
+    monkeypatch.setattr(agentic, "put_file", fake_put)
+    monkeypatch.setattr(agentic, "delete_file", fake_delete)
+
+    run = _run(_plan())
+    run.stage_write("a.py", "a", "Create a.py")
+    run.stage_write("bad.py", "b", "Create bad.py")
+    run.staged["old.txt"] = None
+    run.staged["gone.txt"] = None
+
+    failures = asyncio.run(agentic._commit_staged(run))
+
+    assert writes == [("a.py", "a")]
+    assert deletes == ["old.txt", "gone.txt"]
+    # An already missing file is not a failure; a rejected write is
+    assert list(failures) == ["bad.py"]
+
+
+def test_process_delete_stages_files_that_were_not_prefetched(monkeypatch):
+    async def fake_tree(owner, repo, token=None):
+        return RepoTree(
+            paths=["old.txt"], types=["blob"], shas=["s1"], sha="root", modes=["100644"]
+        )
+
+    async def no_delete(*args, **kwargs):
+        raise AssertionError("deletes must wait for the run's commit")
+
+    monkeypatch.setattr(agentic, "get_repo_tree", fake_tree)
+    monkeypatch.setattr(agentic, "delete_file", no_delete)
+    step = _step(1, ("old.txt", "DELETE"), ("missing.txt", "DELETE"))
+    run = _run(_plan(step))
+
+    assert asyncio.run(agentic._process_delete(run, step, step.files[0])).startswith("✓")
+    assert asyncio.run(agentic._process_delete(run, step, step.files[1])).startswith("↷")
+    assert run.staged == {"old.txt": None}
+
+
+@pytest.mark.parametrize(
+    "answer",
+    [
+        '{"goal": "g", "summary": "s", "steps": []}',
+        '```json\n{"goal": "g", "summary": "s", "steps": []}\n```',
+        'Here is the plan: {"goal": "g", "summary": "s", "steps": []} Let me know!',
+        'Sure.\n```json\n{"goal": "g", "summary": "s", "steps": []}\n```',
+    ],
+)
+def test_validate_json_answer_tolerates_prose(answer):
+    plan = agentic._validate_json_answer(agentic._PLAN_ADAPTER.validate_json, answer)
+    assert plan == PlanResult(goal="g", summary="s", steps=[])
+
+
+def test_validate_json_answer_still_rejects_invalid_plans():
+    with pytest.raises(agentic.ValidationError):
+        agentic._validate_json_answer(
+            agentic._PLAN_ADAPTER.validate_json, 'Plan: {"goal": "g"} done'
+        )
+
+
+def test_generate_plan_refresh_bypasses_the_plan_cache(monkeypatch):
+    async def fake_summary(owner, repo, token=None):
+        return {
+            "all_files": ["a.py"],
+            "total_files": 1,
+            "extensions": Counter({".py": 1}),
+            "directories": set(),
+            "key_files": [],
+            "tree_sha": "tree1",
+        }
+
+    planned = []
+
+    async def fake_planner(llm, repo_full_name, report, goal):
+        planned.append(goal)
+        return _plan(goal=goal)
+
+    stored = {}
+
+    async def fake_lookup(repo_full_name, tree_sha, goal, model):
+        return stored.get((repo_full_name, tree_sha, goal))
+
+    async def fake_store(repo_full_name, tree_sha, goal, plan):
+        stored[(repo_full_name, tree_sha, goal)] = plan
+
+    monkeypatch.setattr(agentic, "build_llm", lambda: None)
+    monkeypatch.setattr(agentic, "get_repository_context_summary", fake_summary)
+    monkeypatch.setattr(agentic, "_run_planner", fake_planner)
+    monkeypatch.setattr(agentic.plan_cache, "lookup", fake_lookup)
+    monkeypatch.setattr(agentic.plan_cache, "store", fake_store)
+
+    asyncio.run(agentic.generate_plan("add a", "o/r"))
+    asyncio.run(agentic.generate_plan("add a", "o/r"))
+    assert planned == ["add a"]
+
+    asyncio.run(agentic.generate_plan("add a", "o/r", refresh=True))
+    assert planned == ["add a", "add a"]
+
+
+def _patch_execution(monkeypatch, generate, commit=None):
+    async def no_prefetch(run):
+        return None
+
+    async def fake_commit(run):
+        return {}
+
+    monkeypatch.setattr(agentic, "build_llm", lambda: None)
+    monkeypatch.setattr(agentic, "_prefetch_sources", no_prefetch)
+    monkeypatch.setattr(agentic, "_generate_step_contents", generate)
+    monkeypatch.setattr(agentic, "_commit_staged", commit or fake_commit)
+
+
+def test_execute_plan_reports_file_failures_and_runs_other_steps(monkeypatch):
+    async def generate(run, step):
+        return {file.path: "content" for file in step.files}
+
+    async def process(run, step, file, content):
+        if file.path == "bad.py":
+            raise RuntimeError("boom")
+        run.stage_write(file.path, content, f"Create {file.path}")
+        return f"✓ Created {file.path}"
+
+    _patch_execution(monkeypatch, generate)
+    monkeypatch.setattr(agentic, "_process_create", process)
+    plan = _plan(_step(1, ("bad.py", "CREATE"), ("a.py", "CREATE")), _step(2, ("b.py", "CREATE")))
+
+    result = asyncio.run(agentic.execute_plan(plan, "o/r"))
+
+    summaries = [step["summary"] for step in result["executionLog"]["steps"]]
+    assert "✗ Error processing bad.py: boom" in summaries[0]
+    assert "✓ Created a.py" in summaries[0]
+    assert "✓ Created b.py" in summaries[1]
+
+
+def test_execute_plan_logs_every_step_error(monkeypatch, caplog):
+    async def generate(run, step):
+        raise ValueError(f"step {step.step_number} failed")
+
+    _patch_execution(monkeypatch, generate)
+    plan = _plan(_step(1, ("a.py", "CREATE")), _step(2, ("b.py", "CREATE")))
+
+    with pytest.raises(ValueError, match="step 1 failed"):
+        asyncio.run(agentic.execute_plan(plan, "o/r"))
+    assert any(
+        record.exc_info and "step 2 failed" in str(record.exc_info[1])
+        for record in caplog.records
+    )
+
+
+@pytest.mark.parametrize(
+    ("path", "goal", "description", "expected"),
+    [
+        ("pkg/py.typed", "add a package", "create the package", ""),
+        ("pkg/.gitkeep", "add a package", "create the package", ""),
+        ("pkg/__init__.py", "add a package", "create the package layout", ""),
+        ("pkg/__init__.py", "add a package that exports Client", "create it", None),
+        ("pkg/__init__.py", "add a package", "expose Client from the package", None),
+        ("pkg/__init__.py", "add a package", "set __all__", None),
+        ("pkg/__init__.py", "add a package", "write pkg/__init__.py", None),
+        ("pkg/.gitkeep", "add .gitkeep with a comment", "create it", None),
+        ("src/app.py", "add a package", "create the package", None),
+    ],
+)
+def test_static_content_for_marker_files(path, goal, description, expected):
+    step = _step(1, (path, "CREATE"), description=description)
+    run = _run(_plan(step, goal=goal))
+
+    assert agentic._static_content(run, step, path) == expected
+
+
+def test_step_dependencies_follow_shared_files():
+    steps = [
+        _step(1, ("a.py", "CREATE")),
+        _step(2, ("b.py", "CREATE")),
+        _step(3, ("a.py", "MODIFY"), ("c.py", "CREATE")),
+        _step(4, ("c.py", "DELETE"), ("b.py", "READ")),
+        _step(5, ("d.py", "CREATE")),
+    ]
+
+    assert agentic._step_dependencies(steps) == [set(), set(), {0}, {1, 2}, set()]
+
+
+def test_execute_plan_orders_only_dependent_steps(monkeypatch):
+    order = []
+    release_first = asyncio.Event()
+
+    async def generate(run, step):
+        order.append(f"start {step.step_number}")
+        if step.step_number == 1:
+            # Step 2 shares no file with step 1 and must not wait for it;
+            # step 3 does and must
+            await release_first.wait()
+        else:
+            release_first.set()
+        order.append(f"end {step.step_number}")
+        return {}
+
+    _patch_execution(monkeypatch, generate)
+    plan = _plan(
+        _step(1, ("a.py", "READ")),
+        _step(2, ("b.py", "READ")),
+        _step(3, ("a.py", "READ")),
+    )
+
+    asyncio.run(agentic.execute_plan(plan, "o/r"))
+
+    assert order.index("start 2") < order.index("end 1")
+    assert order.index("end 1") < order.index("start 3")
+
+
+def test_static_content_for_mit_license():
+    step = _step(1, ("LICENSE", "CREATE"), description="add the license file")
+    run = _run(_plan(step, goal="License the project under MIT"))
+
+    text = agentic._static_content(run, step, "LICENSE")
+    assert text.startswith("MIT License\n")
+    # The repository owner may be an organization or a fork, so it is not assumed
+    assert text.splitlines()[2].endswith(" <copyright holders>")
+    assert "Permission is hereby granted" in text
+
+
+@pytest.mark.parametrize(
+    ("goal", "holder"),
+    [
+        ("Add an MIT license with copyright holder Acme Corp", "Acme Corp"),
+        ("MIT license, Copyright (c) 2024 Jane Doe.", "Jane Doe"),
+        ('License under MIT; copyright holder: "Example Org"', "Example Org"),
+    ],
+)
+def test_static_content_uses_the_named_license_holder(goal, holder):
+    step = _step(1, ("LICENSE", "CREATE"))
+    run = _run(_plan(step, goal=goal))
+
+    text = agentic._static_content(run, step, "LICENSE")
+    assert text.splitlines()[2].endswith(f" {holder}")
+
+
+@pytest.mark.parametrize(
+    "goal", ["add a LICENSE file", "switch from MIT to Apache 2.0", "add an MIT-style GPL license"]
+)
+def test_static_content_leaves_other_licenses_to_the_model(goal):
+    step = _step(1, ("LICENSE", "CREATE"))
+    run = _run(_plan(step, goal=goal))
+
+    assert agentic._static_content(run, step, "LICENSE") is None
+
+
+def test_format_exploration_report_writes_files_as_a_tree():
+    modules = [f"src/pkg/components/module_{i}.py" for i in range(10)]
+    report = agentic._format_exploration_report({
+        "all_files": ["README.md", *modules, "src/pkg/components/sub/c.py"],
+        "extensions": Counter({".py": 11, ".md": 1}),
+        "directories": {"src"},
+        "key_files": ["README.md"],
+    })
+
+    assert report.splitlines()[:16] == [
+        "Files Found (tree; a file's path is its directories joined with its name):",
+        "  README.md",
+        "  src/pkg/components/",
+        *(f"    module_{i}.py" for i in range(10)),
+        "    sub/",
+        "      c.py",
+        "",
+    ]
+    assert "Key Files: README.md" in report
+    assert "Directory Structure: top-level directories src" in report
+    assert "File Types: .py: 11, .md: 1" in report
+
+
+def test_format_exploration_report_keeps_short_lists_flat():
+    report = agentic._format_exploration_report({
+        "all_files": ["a.py", "b.py"],
+        "extensions": Counter({".py": 2}),
+        "directories": set(),
+        "key_files": [],
+    })
+
+    assert report.splitlines()[0] == "Files Found: a.py, b.py"
+    assert "none (all files at root)" in report
+
+
+def test_format_exploration_report_points_to_tools_on_errors():
+    report = agentic._format_exploration_report({"error": "boom", "total_files": 0})
+
+    assert "unavailable (boom)" in report
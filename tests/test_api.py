@@ -0,0 +1,16 @@
+"""Tests for the API application wiring."""
+from __future__ import annotations
+
+import pytest
+
+pytest.importorskip("crewai")
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+from gitpilot import agent_tools, api  # noqa: E402
+
+
+def test_lifespan_shares_the_server_loop_with_tools():
+    with TestClient(api.app):
+        assert agent_tools._app_loop is not None
+    assert agent_tools._app_loop is None
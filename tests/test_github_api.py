@@ -0,0 +1,300 @@
+"""Tests for the GitHub client: single-commit apply and its retries."""
+from __future__ import annotations
+
+import asyncio
+import time
+
+import httpx
+import pytest
+from fastapi import HTTPException
+
+from gitpilot import github_api
+from gitpilot.github_api import RepoTree
+
+
+def _branch_head(commit_sha: str, tree_sha: str) -> dict:
+    return {"commit": {"sha": commit_sha, "commit": {"tree": {"sha": tree_sha}}}}
+
+
+@pytest.fixture
+def repo(github, monkeypatch):
+    """A repository with a regular file, an executable script and a symlink."""
+    tree = RepoTree(
+        paths=["README.md", "run.sh", "link"],
+        types=["blob", "blob", "blob"],
+        shas=["s1", "s2", "s3"],
+        sha="root",
+        modes=["100644", "100755", "120000"],
+    )
+
+    async def fake_tree(owner, repo, token=None):
+        return tree
+
+    monkeypatch.setattr(github_api, "get_repo_tree", fake_tree)
+    github.route("GET", "/repos/o/r", {"default_branch": "main"})
+    github.route("GET", "/repos/o/r/branches/main", _branch_head("head1", "base1"))
+    github.route("POST", "/repos/o/r/git/trees", {"sha": "tree1"})
+    github.route("POST", "/repos/o/r/git/commits", {"sha": "commit1", "html_url": "u"})
+    github.route("PATCH", "/repos/o/r/git/refs/heads/main", {})
+    return github
+
+
+def test_commit_changes_keeps_existing_modes(repo):
+    changes = {"run.sh": "#!/bin/sh\n", "link": "target", "new.py": "x = 1\n", "README.md": None}
+    result = asyncio.run(github_api.commit_changes("o", "r", changes, "msg"))
+
+    assert result == {"commit_sha": "commit1", "commit_url": "u", "tree_sha": "tree1"}
+    (body,) = repo.requests("POST", "/repos/o/r/git/trees")
+    assert body["base_tree"] == "base1"
+    entries = {entry["path"]: entry for entry in body["tree"]}
+    assert entries["run.sh"]["mode"] == "100755"
+    assert entries["link"]["mode"] == "120000"
+    assert entries["new.py"]["mode"] == github_api.DEFAULT_FILE_MODE
+    assert entries["README.md"]["sha"] is None
+    assert repo.requests("PATCH", "/repos/o/r/git/refs/heads/main") == [
+        {"sha": "commit1", "force": False}
+    ]
+
+
+def test_commit_changes_uploads_large_files_as_blobs(repo, monkeypatch):
+    monkeypatch.setattr(github_api, "INLINE_CONTENT_LIMIT", 4)
+    repo.route("POST", "/repos/o/r/git/blobs", {"sha": "blob1"})
+
+    changes = {"big.txt": "0123456789", "s.txt": "ok"}
+    asyncio.run(github_api.commit_changes("o", "r", changes, "msg"))
+
+    (body,) = repo.requests("POST", "/repos/o/r/git/trees")
+    entries = {entry["path"]: entry for entry in body["tree"]}
+    assert entries["big.txt"] == {
+        "path": "big.txt", "mode": "100644", "type": "blob", "sha": "blob1"
+    }
+    assert entries["s.txt"]["content"] == "ok"
+
+
+def test_commit_tree_rebuilds_when_branch_moves(repo):
+    heads = iter([_branch_head("head1", "base1"), _branch_head("head2", "base2")])
+    repo.route("GET", "/repos/o/r/branches/main", lambda _: next(heads))
+    patches = iter([HTTPException(status_code=422, detail="not a fast-forward"), None])
+
+    def patch_ref(body):
+        error = next(patches)
+        if error:
+            raise error
+        return {}
+
+    repo.route("PATCH", "/repos/o/r/git/refs/heads/main", patch_ref)
+
+    asyncio.run(github_api.commit_changes("o", "r", {"a.txt": "a"}, "msg"))
+
+    trees = repo.requests("POST", "/repos/o/r/git/trees")
+    assert [body["base_tree"] for body in trees] == ["base1", "base2"]
+    commits = repo.requests("POST", "/repos/o/r/git/commits")
+    assert [body["parents"] for body in commits] == [["head1"], ["head2"]]
+
+
+def test_commit_tree_gives_up_after_attempts(repo):
+    def reject(body):
+        raise HTTPException(status_code=422, detail="not a fast-forward")
+
+    repo.route("PATCH", "/repos/o/r/git/refs/heads/main", reject)
+
+    with pytest.raises(HTTPException):
+        asyncio.run(github_api.commit_changes("o", "r", {"a.txt": "a"}, "msg"))
+    assert len(repo.requests("PATCH", "/repos/o/r/git/refs/heads/main")) == (
+        github_api.COMMIT_CHANGES_ATTEMPTS
+    )
+
+
+def test_commit_tree_does_not_retry_other_errors(repo):
+    def forbidden(body):
+        raise HTTPException(status_code=403, detail="forbidden")
+
+    repo.route("PATCH", "/repos/o/r/git/refs/heads/main", forbidden)
+
+    with pytest.raises(HTTPException):
+        asyncio.run(github_api.commit_changes("o", "r", {"a.txt": "a"}, "msg"))
+    assert len(repo.requests("PATCH", "/repos/o/r/git/refs/heads/main")) == 1
+
+
+def test_repo_write_locks_are_per_loop_and_released():
+    async def check_same_loop():
+        first = github_api._repo_write_lock("o", "r")
+        assert github_api._repo_write_lock("o", "r") is first
+        assert github_api._repo_write_lock("o", "other") is not first
+
+    async def lock_for(owner, repo):
+        return github_api._repo_write_lock(owner, repo)
+
+    asyncio.run(check_same_loop())
+    # Locks nobody holds are not kept around
+    assert not any(len(locks) for locks in github_api._repo_write_locks.values())
+    # Each event loop gets its own lock
+    assert asyncio.run(lock_for("o", "r")) is not asyncio.run(lock_for("o", "r"))
+
+
+@pytest.mark.parametrize(
+    ("owner", "repo"),
+    [("..", ".."), ("../../etc", "passwd"), ("o", "../../../x"), ("/abs", "r"), ("o\\\\x", "r")],
+)
+def test_tree_cache_stays_inside_its_directory(tmp_path, monkeypatch, owner, repo):
+    cache_dir = tmp_path / "tree"
+    monkeypatch.setattr(github_api, "TREE_CACHE_DIR", cache_dir)
+    tree = RepoTree(paths=["a"], types=["blob"], shas=["s"], sha="root", modes=["100644"])
+
+    github_api._write_cached_tree(owner, repo, "etag", tree)
+
+    written = [path for path in tmp_path.rglob("*") if path.is_file()]
+    assert [path.parent for path in written] == [cache_dir]
+    assert github_api._read_cached_tree(owner, repo) == ("etag", tree)
+
+
+def test_tree_cache_without_modes_is_refetched(tmp_path, monkeypatch):
+    monkeypatch.setattr(github_api, "TREE_CACHE_DIR", tmp_path)
+    github_api._tree_cache_file("o", "r").write_bytes(
+        b'{"etag": "e", "sha": "root", "paths": ["a"], "types": ["blob"], "shas": ["s"]}'
+    )
+
+    assert github_api._read_cached_tree("o", "r") == (None, None)
+
+
+def _response(status: int, headers: dict | None = None, text: str = "") -> httpx.Response:
+    return httpx.Response(status, headers=headers or {}, text=text)
+
+
+def test_rate_limit_delay_ignores_other_responses():
+    assert github_api._rate_limit_delay(_response(200), 0) is None
+    assert github_api._rate_limit_delay(_response(404), 0) is None
+    # A 403 without rate-limit signals is a permission problem
+    assert github_api._rate_limit_delay(_response(403, text="Forbidden"), 0) is None
+
+
+def test_rate_limit_delay_honors_retry_after():
+    assert github_api._rate_limit_delay(_response(429, {"Retry-After": "7"}), 0) == 7.0
+    assert github_api._rate_limit_delay(_response(403, {"Retry-After": "soon"}), 0) is None
+
+
+def test_rate_limit_delay_waits_for_reset():
+    reset = str(int(time.time()) + 10)
+    headers = {"X-RateLimit-Remaining": "0", "X-RateLimit-Reset": reset}
+    assert 8.0 <= github_api._rate_limit_delay(_response(403, headers), 0) <= 10.0
+
+    past = {"X-RateLimit-Remaining": "0", "X-RateLimit-Reset": str(int(time.time()) - 5)}
+    assert github_api._rate_limit_delay(_response(403, past), 0) == 0.0
+
+
+def test_rate_limit_delay_gives_up_on_long_waits():
+    too_long = str(github_api.MAX_RATE_LIMIT_WAIT + 1)
+    assert github_api._rate_limit_delay(_response(429, {"Retry-After": too_long}), 0) is None
+
+
+def test_rate_limit_delay_backs_off_on_secondary_limits():
+    resp = _response(403, text='{"message": "You have exceeded a secondary rate limit"}')
+    first = github_api._rate_limit_delay(resp, 0)
+    second = github_api._rate_limit_delay(resp, 1)
+    assert 5.0 <= first < 6.0
+    assert 10.0 <= second < 11.0
+
+
+@pytest.fixture
+def transport(monkeypatch):
+    """Route the shared client through a scripted transport; record sleeps."""
+    responses: list[httpx.Response] = []
+    requests: list[httpx.Request] = []
+    sleeps: list[float] = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        return responses.pop(0)
+
+    def client():
+        return httpx.AsyncClient(
+            base_url=github_api.GITHUB_API_BASE, transport=httpx.MockTransport(handler)
+        )
+
+    async def fake_sleep(delay):
+        sleeps.append(delay)
+
+    monkeypatch.setattr(github_api, "get_client", client)
+    monkeypatch.setattr(github_api.asyncio, "sleep", fake_sleep)
+    return responses, requests, sleeps
+
+
+def test_github_send_retries_rate_limited_requests(transport):
+    responses, requests, sleeps = transport
+    responses += [_response(429, {"Retry-After": "1"}), _response(200, text="{}")]
+
+    resp = asyncio.run(github_api._github_send("/x", token="t"))
+
+    assert resp.status_code == 200
+    assert len(requests) == 2
+    assert sleeps == [1.0]
+
+
+def test_github_send_stops_after_retry_budget(transport):
+    responses, requests, sleeps = transport
+    responses += [_response(429, {"Retry-After": "1"})] * (github_api.RATE_LIMIT_RETRIES + 1)
+
+    with pytest.raises(HTTPException) as excinfo:
+        asyncio.run(github_api._github_send("/x", token="t"))
+
+    assert excinfo.value.status_code == 429
+    assert len(requests) == github_api.RATE_LIMIT_RETRIES + 1
+    assert len(sleeps) == github_api.RATE_LIMIT_RETRIES
+
+
+def test_rate_limit_budget_shortens_retries(transport):
+    responses, requests, sleeps = transport
+    responses += [_response(429, {"Retry-After": "1"}), _response(429, {"Retry-After": "30"})]
+
+    async def send():
+        with github_api.rate_limit_budget(retries=1, max_wait=10.0):
+            return await github_api._github_send("/x", token="t")
+
+    with pytest.raises(HTTPException) as excinfo:
+        asyncio.run(send())
+
+    assert excinfo.value.status_code == 429
+    assert len(requests) == 2
+    assert sleeps == [1.0]
+
+
+def test_get_repo_tree_revalidates_with_etag(transport, tmp_path, monkeypatch):
+    monkeypatch.setattr(github_api, "TREE_CACHE_DIR", tmp_path)
+    responses, requests, _ = transport
+    body = (
+        '{"sha": "root", "tree": ['
+        '{"path": "run.sh", "type": "blob", "sha": "s1", "mode": "100755"},'
+        '{"path": "src", "type": "tree", "sha": "s2", "mode": "040000"}]}'
+    )
+    responses += [
+        httpx.Response(200, headers={"ETag": '"v1"'}, text=body),
+        _response(304),
+    ]
+
+    first = asyncio.run(github_api.get_repo_tree("o", "r", token="t"))
+    second = asyncio.run(github_api.get_repo_tree("o", "r", token="t"))
+
+    assert first.paths == ["run.sh"]
+    assert first.modes == ["100755"]
+    assert first.sha == "root"
+    assert second == first
+    assert "If-None-Match" not in requests[0].headers
+    assert requests[1].headers["If-None-Match"] == '"v1"'
+
+
+def test_get_file_blob_survives_eviction_during_revalidation(monkeypatch):
+    key = ("o", "r", "a.txt")
+
+    async def evict_then_send(*args, **kwargs):
+        # Another reader evicts the entry while this request is in flight
+        github_api._blob_etags.pop(key, None)
+        return _response(304)
+
+    monkeypatch.setattr(github_api, "_blob_etags", github_api.OrderedDict())
+    github_api._blob_etags[key] = ('"v1"', {"sha": "s1", "text": "hello"})
+    monkeypatch.setattr(github_api, "_github_send", evict_then_send)
+
+    blob = asyncio.run(github_api.get_file_blob("o", "r", "a.txt", token="t"))
+
+    assert blob == {"sha": "s1", "text": "hello"}
+    assert github_api._blob_etags[key] == ('"v1"', {"sha": "s1", "text": "hello"})
@@ -0,0 +1,104 @@
+"""Tests for plan reuse across equivalent goals."""
+from __future__ import annotations
+
+import asyncio
+from typing import List, Literal
+
+import pytest
+from pydantic import BaseModel
+
+from gitpilot import cache_db, plan_cache
+
+
+class File(BaseModel):
+    path: str
+    action: Literal["CREATE", "MODIFY", "DELETE", "READ"]
+
+
+class Step(BaseModel):
+    files: List[File]
+
+
+class Plan(BaseModel):
+    goal: str
+    steps: List[Step]
+
+
+def _plan(goal: str, action: str = "CREATE", path: str = "a.py") -> Plan:
+    return Plan(goal=goal, steps=[Step(files=[File(path=path, action=action)])])
+
+
+class Vector(tuple):
+    """Just enough of a numpy vector for plan_cache."""
+
+    def __matmul__(self, other):
+        return sum(a * b for a, b in zip(self, other, strict=True))
+
+    def astype(self, dtype):
+        return self
+
+    def tobytes(self):
+        return b""
+
+
+@pytest.fixture(autouse=True)
+def isolated_cache(monkeypatch):
+    """Keep entries in memory only and start every test empty."""
+    monkeypatch.setattr(plan_cache, "_entries", type(plan_cache._entries)())
+    monkeypatch.setattr(cache_db, "get_plans", lambda repo, tree_sha: [])
+    monkeypatch.setattr(cache_db, "put_plan", lambda *args: None)
+
+
+@pytest.fixture
+def embeddings(monkeypatch):
+    """Embed every goal to the same vector, so every goal counts as similar."""
+    monkeypatch.setattr(plan_cache, "_embed", lambda text: Vector((1.0, 0.0)))
+
+
+def _lookup(goal: str, tree_sha: str = "tree1"):
+    return asyncio.run(plan_cache.lookup("o/r", tree_sha, goal, Plan))
+
+
+def _store(goal: str, plan: Plan, tree_sha: str = "tree1") -> None:
+    asyncio.run(plan_cache.store("o/r", tree_sha, goal, plan))
+
+
+def test_exact_goal_is_reused_on_same_tree(monkeypatch):
+    monkeypatch.setattr(plan_cache, "_embed", lambda text: None)
+    plan = _plan("Add a CLI")
+    _store("Add a CLI", plan)
+
+    assert _lookup("  add a   cli ") == plan
+    assert _lookup("Add a CLI", tree_sha="tree2") is None
+
+
+def test_similar_goal_is_reused(embeddings):
+    plan = _plan("add logging")
+    _store("add logging", plan)
+
+    assert _lookup("please add logging") == _plan("please add logging")
+
+
+def test_similar_goal_never_reuses_deletions(embeddings):
+    plan = _plan("delete everything except README.md", action="DELETE", path="LICENSE")
+    _store("delete everything except README.md", plan)
+
+    assert _lookup("delete everything except LICENSE") is None
+    assert _lookup("Delete everything except README.md") == plan
+
+
+def test_similar_goal_must_name_the_same_files(embeddings):
+    plan = _plan("add tests for app.py")
+    _store("add tests for app.py", plan)
+
+    assert _lookup("add tests for cli.py") is None
+    assert _lookup("add unit tests for app.py") == _plan("add unit tests for app.py")
+
+
+def test_storing_a_new_tree_drops_older_trees(monkeypatch):
+    monkeypatch.setattr(plan_cache, "_embed", lambda text: None)
+    _store("add a cli", _plan("add a cli"), tree_sha="tree1")
+    _store("add a cli", _plan("add a cli"), tree_sha="tree2")
+
+    assert _lookup("add a cli", tree_sha="tree1") is None
+    assert _lookup("add a cli", tree_sha="tree2") is not None